@@ -0,0 +1,25 @@
+"""Архивация рассчитанных ставок (для запуска по cron)
+
+Пример: python archive_bets.py --older-than-days 30
+"""
+import argparse
+
+from sqlmodel import Session
+
+from main import ARCHIVE_AFTER_DAYS, ARCHIVE_BATCH_SIZE, archive_settled_bets, create_db_and_tables, engine
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Перенос рассчитанных ставок в архивные таблицы")
+    parser.add_argument("--older-than-days", type=int, default=ARCHIVE_AFTER_DAYS)
+    parser.add_argument("--batch-size", type=int, default=ARCHIVE_BATCH_SIZE)
+    args = parser.parse_args()
+
+    create_db_and_tables()
+    with Session(engine) as session:
+        result = archive_settled_bets(session, args.older_than_days, args.batch_size)
+    print(f"Архивировано событий: {result['archived_bets']}, ставок: {result['archived_wagers']}")
+
+
+if __name__ == "__main__":
+    main()
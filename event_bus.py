@@ -0,0 +1,166 @@
+"""Шина событий между API (main.py) и ботом (theroflint.py)
+
+Redis Streams с consumer groups и подтверждениями, либо in-process замена
+(EVENT_BUS_URL=memory://) для тестов и запуска API и бота в одном процессе.
+"""
+import itertools
+import json
+import threading
+import time
+from collections import defaultdict
+
+# Запросы верификации: API -> бот (consumer group бота, каждое сообщение обрабатывает один экземпляр)
+VERIFICATION_REQUESTS = "verification:requests"
+# Результаты верификации: бот -> API (каждый воркер API читает поток целиком и ищет свои request_id)
+VERIFICATION_RESULTS = "verification:results"
+
+STREAM_MAXLEN = 10000
+
+
+def _seq(message_id: str) -> tuple:
+    ms, _, seq = message_id.partition("-")
+    return int(ms), int(seq or 0)
+
+
+class InMemoryBus:
+    """Потоки и consumer groups в памяти процесса"""
+
+    def __init__(self, maxlen: int = STREAM_MAXLEN):
+        self.maxlen = maxlen
+        self._streams = defaultdict(list)  # stream -> [(id, fields)]
+        self._groups = {}  # (stream, group) -> {"last_id": id, "pending": {id: (consumer, delivered_at, fields)}}
+        self._counter = itertools.count(1)
+        self._cond = threading.Condition()
+
+    def publish(self, stream: str, fields: dict) -> str:
+        with self._cond:
+            message_id = f"{next(self._counter)}-0"
+            entries = self._streams[stream]
+            entries.append((message_id, dict(fields)))
+            if len(entries) > self.maxlen:
+                del entries[:len(entries) - self.maxlen]
+            self._cond.notify_all()
+            return message_id
+
+    def latest_id(self, stream: str) -> str:
+        with self._cond:
+            entries = self._streams[stream]
+            return entries[-1][0] if entries else "0-0"
+
+    def read(self, stream: str, last_id: str, count: int = 100, block_ms: int = 1000) -> list:
+        """Сообщения после last_id без группы (каждый читатель видит всё)"""
+        deadline = time.monotonic() + block_ms / 1000
+        with self._cond:
+            while True:
+                result = [
+                    (message_id, dict(fields)) for message_id, fields in self._streams[stream]
+                    if _seq(message_id) > _seq(last_id)
+                ][:count]
+                remaining = deadline - time.monotonic()
+                if result or remaining <= 0:
+                    return result
+                self._cond.wait(remaining)
+
+    def read_group(self, stream: str, group: str, consumer: str, count: int = 10, block_ms: int = 1000,
+                   claim_idle_ms: int = 30000) -> list:
+        """Новые сообщения группы плюс зависшие у упавших потребителей дольше claim_idle_ms"""
+        deadline = time.monotonic() + block_ms / 1000
+        with self._cond:
+            state = self._groups.setdefault((stream, group), {"last_id": "0-0", "pending": {}})
+            while True:
+                now = time.monotonic()
+                result = []
+                for message_id, (owner, delivered_at, fields) in list(state["pending"].items()):
+                    if len(result) < count and now - delivered_at >= claim_idle_ms / 1000:
+                        state["pending"][message_id] = (consumer, now, fields)
+                        result.append((message_id, dict(fields)))
+                for message_id, fields in self._streams[stream]:
+                    if len(result) >= count:
+                        break
+                    if _seq(message_id) > _seq(state["last_id"]):
+                        state["last_id"] = message_id
+                        state["pending"][message_id] = (consumer, now, fields)
+                        result.append((message_id, dict(fields)))
+                remaining = deadline - time.monotonic()
+                if result or remaining <= 0:
+                    return result
+                self._cond.wait(remaining)
+
+    def ack(self, stream: str, group: str, message_id: str):
+        with self._cond:
+            state = self._groups.get((stream, group))
+            if state:
+                state["pending"].pop(message_id, None)
+
+
+class RedisStreamBus:
+    """Redis Streams: XADD / XREAD / XREADGROUP / XAUTOCLAIM / XACK"""
+
+    def __init__(self, client, maxlen: int = STREAM_MAXLEN):
+        self.client = client
+        self.maxlen = maxlen
+        self._groups = set()
+
+    @staticmethod
+    def _decode(value):
+        return value.decode() if isinstance(value, bytes) else value
+
+    def _parse(self, entries) -> list:
+        messages = []
+        for message_id, fields in entries:
+            if not fields:  # запись уже удалена из потока (XAUTOCLAIM)
+                continue
+            data = fields.get(b"data", fields.get("data"))
+            messages.append((self._decode(message_id), json.loads(self._decode(data))))
+        return messages
+
+    def publish(self, stream: str, fields: dict) -> str:
+        message_id = self.client.xadd(stream, {"data": json.dumps(fields)}, maxlen=self.maxlen, approximate=True)
+        return self._decode(message_id)
+
+    def latest_id(self, stream: str) -> str:
+        entries = self.client.xrevrange(stream, count=1)
+        return self._decode(entries[0][0]) if entries else "0-0"
+
+    def read(self, stream: str, last_id: str, count: int = 100, block_ms: int = 1000) -> list:
+        response = self.client.xread({stream: last_id}, count=count, block=block_ms)
+        return self._parse(response[0][1]) if response else []
+
+    def _ensure_group(self, stream: str, group: str):
+        if (stream, group) in self._groups:
+            return
+        try:
+            self.client.xgroup_create(stream, group, id="0", mkstream=True)
+        except Exception as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+        self._groups.add((stream, group))
+
+    def read_group(self, stream: str, group: str, consumer: str, count: int = 10, block_ms: int = 1000,
+                   claim_idle_ms: int = 30000) -> list:
+        self._ensure_group(stream, group)
+        claimed = self.client.xautoclaim(stream, group, consumer, min_idle_time=claim_idle_ms, count=count)
+        messages = self._parse(claimed[1])
+        if messages:
+            return messages
+        response = self.client.xreadgroup(group, consumer, {stream: ">"}, count=count, block=block_ms)
+        return self._parse(response[0][1]) if response else []
+
+    def ack(self, stream: str, group: str, message_id: str):
+        self.client.xack(stream, group, message_id)
+
+
+_memory_bus = None
+
+
+def create_bus(url: str, socket_timeout: float = 10.0):
+    """memory:// — общая шина процесса, иначе Redis по URL"""
+    global _memory_bus
+    if url.startswith("memory://"):
+        if _memory_bus is None:
+            _memory_bus = InMemoryBus()
+        return _memory_bus
+
+    import redis
+    # socket_timeout должен быть больше времени блокирующего чтения
+    return RedisStreamBus(redis.from_url(url, socket_connect_timeout=1.0, socket_timeout=socket_timeout))
@@ -0,0 +1,33 @@
+# Многопроцессный запуск: gunicorn -c gunicorn.conf.py main:app
+import gc
+import multiprocessing
+import os
+
+bind = os.getenv("BIND", "0.0.0.0:8000")
+workers = int(os.getenv("WEB_CONCURRENCY", str(multiprocessing.cpu_count())))
+worker_class = "uvicorn.workers.UvicornWorker"
+timeout = int(os.getenv("WORKER_TIMEOUT", "30"))
+keepalive = int(os.getenv("KEEPALIVE", "5"))
+
+# Приложение импортируется один раз в мастере, воркеры получают его через fork
+# и делят страницы памяти с кодом и моделями (copy-on-write)
+preload_app = True
+
+
+def on_starting(server):
+    import main
+    main.create_db_and_tables()
+
+
+def when_ready(server):
+    # Переносим объекты мастера в постоянное поколение, чтобы сборщик мусора
+    # в воркерах не трогал их и не копировал страницы памяти
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    import main
+    # Соединения из пула мастера не должны использоваться в воркерах
+    main.engine.dispose(close=False)
+    if main.read_engine is not main.engine:
+        main.read_engine.dispose(close=False)
@@ -1,20 +1,40 @@
 from fastapi import FastAPI, HTTPException, Depends, Form, status, Request
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import ORJSONResponse, Response
+from starlette.datastructures import Headers, MutableHeaders
 from sqlmodel import SQLModel, create_engine, Session, select, Field, Relationship
-from typing import List, Optional
+from sqlalchemy import Index, event, delete, func, insert, literal, text, update, bindparam
+from sqlalchemy.engine import Engine, make_url
+from typing import List, Optional, Literal
 from datetime import datetime, timedelta
 import json
+import base64
 import secrets
+from collections import OrderedDict
 from passlib.context import CryptContext
 from jose import JWTError, jwt
 import redis
-from pydantic import BaseModel
+from pydantic import BaseModel, PositiveFloat
 import uvicorn
 import os
+import asyncio
+import gzip
+import heapq
+import hashlib
+import mimetypes
+import threading
+import time
+import uuid
 import httpx
+from migrate import run_migrations
+from event_bus import VERIFICATION_REQUESTS, VERIFICATION_RESULTS, create_bus
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
 
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///betting_system.db")
 SECRET_KEY = os.getenv("SECRET_KEY", "your-secret-key-change-in-production")
@@ -22,18 +42,364 @@ ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "30"))
 ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "admin-secure-token-change-in-production")
 REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379")
+REDIS_CONNECT_TIMEOUT = float(os.getenv("REDIS_CONNECT_TIMEOUT", "0.5"))
+REDIS_SOCKET_TIMEOUT = float(os.getenv("REDIS_SOCKET_TIMEOUT", "0.5"))
+REDIS_HEALTH_CHECK_INTERVAL = int(os.getenv("REDIS_HEALTH_CHECK_INTERVAL", "5"))
+
+# Настройки SQLite для работы нескольких воркеров с одним файлом
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL").upper()
+if SQLITE_SYNCHRONOUS not in ("OFF", "NORMAL", "FULL", "EXTRA"):
+    raise ValueError(f"Invalid SQLITE_SYNCHRONOUS value: {SQLITE_SYNCHRONOUS}")
+
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "1"))
+
+# Пул соединений для серверных СУБД (PostgreSQL)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", "10"))
+
+# Максимальное число ставок в одном запросе /place_bets
+MAX_BATCH_BETS = int(os.getenv("MAX_BATCH_BETS", "50"))
+
+# Размер пачки для массовых админских операций (один commit на пачку)
+BULK_CHUNK_SIZE = int(os.getenv("BULK_CHUNK_SIZE", "1000"))
+
+# Сжатие ответов и статика фронтенда
+FRONTEND_DIR = os.getenv("FRONTEND_DIR", "/var/www/betting-system/frontend")
+COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", "1024"))
+# Ответы API сжимаются на лету, поэтому уровень ниже, чем у статики (11)
+BROTLI_API_QUALITY = int(os.getenv("BROTLI_API_QUALITY", "5"))
+STATIC_MAX_AGE = int(os.getenv("STATIC_MAX_AGE", "86400"))
+
+# Планировщик закрытия ставок по end_time
+BET_SCHEDULER_ENABLED = os.getenv("BET_SCHEDULER_ENABLED", "true").lower() == "true"
+# Источник результатов: GET {RESULT_SOURCE_URL}/{bet_id} -> {"winning_option": "..."}
+RESULT_SOURCE_URL = os.getenv("RESULT_SOURCE_URL", "")
+SETTLE_RETRY_SECONDS = int(os.getenv("SETTLE_RETRY_SECONDS", "60"))
+SETTLE_MAX_ATTEMPTS = int(os.getenv("SETTLE_MAX_ATTEMPTS", "30"))
+
+# Журнал баллов: период снимков балансов в секундах (0 — только вручную)
+BALANCE_SNAPSHOT_INTERVAL = int(os.getenv("BALANCE_SNAPSHOT_INTERVAL", "3600"))
+
+# Idempotency-Key: повторы запросов получают сохранённый ответ
+IDEMPOTENCY_TTL = int(os.getenv("IDEMPOTENCY_TTL", "86400"))
+IDEMPOTENCY_PENDING_TTL = int(os.getenv("IDEMPOTENCY_PENDING_TTL", "30"))
+IDEMPOTENCY_LOCAL_MAX = int(os.getenv("IDEMPOTENCY_LOCAL_MAX", "10000"))
+IDEMPOTENT_PATHS = {"/place_bet", "/place_bets", "/webhook/discord-verified"}
+
+# Чтение с реплики: READ_DATABASE_URL, либо для SQLite отдельный read-only пул к тому же файлу (WAL)
+READ_DATABASE_URL = os.getenv("READ_DATABASE_URL", "")
+READ_LAG_CHECK_INTERVAL = float(os.getenv("READ_LAG_CHECK_INTERVAL", "1"))
+# Допустимое отставание реплики по маршрутам в секундах; маршрут без значения всегда читает с основной БД
+READ_STALENESS = {
+    route: float(seconds)
+    for route, _, seconds in (
+        item.strip().partition("=")
+        for item in os.getenv("READ_STALENESS", "bets=5,leaderboard=30,admin_all_bets=5,admin_users=5").split(",")
+    )
+    if route and seconds
+}
+
+# Архивация рассчитанных ставок
+ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", "30"))
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", "500"))
 
 # Discord webhook конфигурация
 DISCORD_WEBHOOK_URL = os.getenv("DISCORD_WEBHOOK_URL", "http://localhost:5001/webhook/verify")
 DISCORD_WEBHOOK_SECRET = os.getenv("DISCORD_WEBHOOK_SECRET", "ABOBAROFLINT228ZXC")
+DISCORD_CONNECT_TIMEOUT = float(os.getenv("DISCORD_CONNECT_TIMEOUT", "1.0"))
+DISCORD_READ_TIMEOUT = float(os.getenv("DISCORD_READ_TIMEOUT", "3.0"))
+# Circuit breaker: после N ошибок подряд запросы к боту не отправляются reset_timeout секунд
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", "5"))
+BREAKER_RESET_TIMEOUT = float(os.getenv("BREAKER_RESET_TIMEOUT", "30"))
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "100"))
+# Транспорт верификации: http — webhook бота, bus — Redis Streams (memory:// для тестов)
+VERIFICATION_TRANSPORT = os.getenv("VERIFICATION_TRANSPORT", "http")
+EVENT_BUS_URL = os.getenv("EVENT_BUS_URL", REDIS_URL)
+VERIFICATION_BUS_TIMEOUT = float(os.getenv("VERIFICATION_BUS_TIMEOUT", "5"))
+
+
+
+class RedisManager:
+    """Ленивое подключение к Redis с фоновым переподключением"""
+
+    def __init__(self, url: str):
+        self.url = url
+        self.available = False
+        self._client: Optional[redis.Redis] = None
+        self._checked = False
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _create_client(self) -> redis.Redis:
+        return redis.from_url(
+            self.url,
+            socket_connect_timeout=REDIS_CONNECT_TIMEOUT,
+            socket_timeout=REDIS_SOCKET_TIMEOUT,
+            health_check_interval=REDIS_HEALTH_CHECK_INTERVAL,
+        )
 
-try:
-    redis_client = redis.from_url(REDIS_URL)
-    redis_client.ping()
-    REDIS_AVAILABLE = True
-except:
-    REDIS_AVAILABLE = False
-    print("Redis недоступен. Защита от брутфорса отключена.")
+    def check(self) -> bool:
+        """Проверить соединение и обновить флаг доступности"""
+        with self._lock:
+            self._checked = True
+            try:
+                if self._client is None:
+                    self._client = self._create_client()
+                self._client.ping()
+                if not self.available:
+                    print("Redis доступен. Защита от брутфорса включена.")
+                self.available = True
+            except redis.RedisError:
+                if self.available or self._thread is None:
+                    print("Redis недоступен. Защита от брутфорса отключена.")
+                self.available = False
+        return self.available
+
+    def get_client(self) -> Optional[redis.Redis]:
+        """Вернуть клиент, если Redis доступен, иначе None"""
+        if not self._checked:
+            self.check()
+        return self._client if self.available else None
+
+    def mark_failed(self):
+        """Отметить Redis как недоступный до следующей успешной проверки"""
+        if self.available:
+            print("Redis недоступен. Защита от брутфорса отключена.")
+        self.available = False
+
+    def _monitor(self):
+        while not self._stop_event.wait(REDIS_HEALTH_CHECK_INTERVAL):
+            self.check()
+
+    def start(self):
+        """Запустить фоновую проверку здоровья соединения"""
+        if self._thread is not None:
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._monitor, name="redis-monitor", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout=REDIS_HEALTH_CHECK_INTERVAL)
+            self._thread = None
+
+
+redis_manager = RedisManager(REDIS_URL)
+
+
+class IdempotencyStore:
+    """Записи по Idempotency-Key: Redis с TTL, при недоступности — LRU в памяти процесса"""
+
+    def __init__(self, max_local: int = IDEMPOTENCY_LOCAL_MAX):
+        self.max_local = max_local
+        self._local = OrderedDict()  # key -> (expires_at, record)
+        self._lock = threading.Lock()
+
+    def begin(self, key: str, fingerprint: str) -> Optional[dict]:
+        """Занять ключ. None — запрос новый; иначе существующая запись (pending или done)"""
+        pending = {"state": "pending", "fingerprint": fingerprint}
+        redis_client = redis_manager.get_client()
+        if redis_client is not None:
+            try:
+                if redis_client.set(key, json.dumps(pending), nx=True, ex=IDEMPOTENCY_PENDING_TTL):
+                    return None
+                raw = redis_client.get(key)
+                return json.loads(raw) if raw else None
+            except redis.RedisError:
+                redis_manager.mark_failed()
+
+        with self._lock:
+            record = self._get_local(key)
+            if record is not None:
+                return record
+            self._set_local(key, pending, IDEMPOTENCY_PENDING_TTL)
+            return None
+
+    def complete(self, key: str, record: dict):
+        record = {"state": "done", **record}
+        redis_client = redis_manager.get_client()
+        if redis_client is not None:
+            try:
+                redis_client.set(key, json.dumps(record), ex=IDEMPOTENCY_TTL)
+                with self._lock:
+                    self._local.pop(key, None)
+                return
+            except redis.RedisError:
+                redis_manager.mark_failed()
+
+        with self._lock:
+            self._set_local(key, record, IDEMPOTENCY_TTL)
+
+    def release(self, key: str):
+        """Освободить ключ после ошибки, чтобы повтор обработался заново"""
+        redis_client = redis_manager.get_client()
+        if redis_client is not None:
+            try:
+                redis_client.delete(key)
+            except redis.RedisError:
+                redis_manager.mark_failed()
+        with self._lock:
+            self._local.pop(key, None)
+
+    def _get_local(self, key: str) -> Optional[dict]:
+        entry = self._local.get(key)
+        if entry is None:
+            return None
+        expires_at, record = entry
+        if expires_at < time.monotonic():
+            del self._local[key]
+            return None
+        self._local.move_to_end(key)
+        return record
+
+    def _set_local(self, key: str, record: dict, ttl: int):
+        self._local[key] = (time.monotonic() + ttl, record)
+        self._local.move_to_end(key)
+        while len(self._local) > self.max_local:
+            self._local.popitem(last=False)
+
+
+idempotency_store = IdempotencyStore()
+
+
+class CircuitBreaker:
+    """closed -> open после failure_threshold ошибок подряд; через reset_timeout один пробный запрос"""
+
+    def __init__(self, name: str, failure_threshold: int = BREAKER_FAILURE_THRESHOLD,
+                 reset_timeout: float = BREAKER_RESET_TIMEOUT):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+
+    def allow(self) -> bool:
+        if self.state == "closed":
+            return True
+        # В half_open пробный запрос уже в пути; если он так и не отчитался, пускаем следующий
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            self.state = "half_open"
+            self.opened_at = time.monotonic()
+            return True
+        return False
+
+    def record_success(self):
+        self.state = "closed"
+        self.failures = 0
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == "half_open" or self.failures >= self.failure_threshold:
+            if self.state != "open":
+                print(f"Circuit breaker {self.name} разомкнут после {self.failures} ошибок")
+            self.state = "open"
+            self.opened_at = time.monotonic()
+
+    def status(self) -> dict:
+        status = {"state": self.state, "failures": self.failures}
+        if self.state == "open":
+            status["retry_in"] = max(self.reset_timeout - (time.monotonic() - self.opened_at), 0)
+        return status
+
+
+discord_bot_breaker = CircuitBreaker("discord_bot")
+
+class VerificationBusClient:
+    """Запросы верификации через шину событий.
+
+    Каждый воркер читает поток результатов целиком и будит только свои ожидающие
+    запросы по request_id, поэтому ответ дойдёт до воркера, который его ждёт.
+    """
+
+    def __init__(self):
+        self.bus = None
+        self._waiters = {}
+        self._last_id: Optional[str] = None  # None — позиция в потоке ещё не получена
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is not None:
+            return
+        self.bus = create_bus(EVENT_BUS_URL)
+        try:
+            self._last_id = self.bus.latest_id(VERIFICATION_RESULTS)
+        except redis.RedisError as e:
+            # Redis недоступен при старте: приложение поднимается, _listen переподключится сам
+            print(f"Шина событий недоступна: {e}")
+        self._task = asyncio.create_task(self._listen())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def request(self, payload: dict) -> tuple:
+        """Опубликовать запрос и дождаться (status_code, body) от бота"""
+        if self._task is None:
+            self.start()
+        if self._last_id is None:
+            # Без позиции в потоке результат этого запроса мог бы быть пропущен
+            self._last_id = await asyncio.to_thread(self.bus.latest_id, VERIFICATION_RESULTS)
+        request_id = uuid.uuid4().hex
+        future = asyncio.get_running_loop().create_future()
+        self._waiters[request_id] = future
+        try:
+            await asyncio.to_thread(self.bus.publish, VERIFICATION_REQUESTS, {**payload, "request_id": request_id})
+            return await asyncio.wait_for(future, VERIFICATION_BUS_TIMEOUT)
+        finally:
+            self._waiters.pop(request_id, None)
+
+    async def _listen(self):
+        while True:
+            try:
+                if self._last_id is None:
+                    self._last_id = await asyncio.to_thread(self.bus.latest_id, VERIFICATION_RESULTS)
+                messages = await asyncio.to_thread(self.bus.read, VERIFICATION_RESULTS, self._last_id, 100, 1000)
+            except Exception as e:
+                print(f"Ошибка чтения результатов верификации: {e}")
+                await asyncio.sleep(1)
+                continue
+
+            for message_id, fields in messages:
+                self._last_id = message_id
+                future = self._waiters.get(fields.get("request_id"))
+                if future is not None and not future.done():
+                    future.set_result((fields.get("status", 500), fields.get("body", {})))
+
+
+verification_bus = VerificationBusClient()
+
+# Общий HTTP клиент на всё время жизни приложения: пул соединений и жёсткие таймауты
+http_client: Optional[httpx.AsyncClient] = None
+
+
+def get_http_client() -> httpx.AsyncClient:
+    global http_client
+    if http_client is None:
+        http_client = httpx.AsyncClient(
+            timeout=httpx.Timeout(DISCORD_READ_TIMEOUT, connect=DISCORD_CONNECT_TIMEOUT),
+            limits=httpx.Limits(max_connections=HTTP_MAX_CONNECTIONS, max_keepalive_connections=20)
+        )
+    return http_client
+
+
+async def close_http_client():
+    global http_client
+    if http_client is not None:
+        await http_client.aclose()
+        http_client = None
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 security = HTTPBearer()
@@ -46,6 +412,9 @@ class BetOption(BaseModel):
 
 
 class Bet(SQLModel, table=True):
+    # AUTOINCREMENT: SQLite не выдаёт заново id, ушедшие в архив
+    __table_args__ = {"sqlite_autoincrement": True}
+
     id: Optional[int] = Field(default=None, primary_key=True)
     title: str
     description: Optional[str] = None
@@ -71,9 +440,9 @@ class User(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
     username: str = Field(unique=True)
     email: str = Field(unique=True)
-    discord_id: Optional[str] = None  # Добавлено для связи с Discord
+    discord_id: Optional[str] = Field(default=None, index=True)  # Добавлено для связи с Discord
     hashed_password: str
-    points: float = Field(default=1000.0)
+    points: float = Field(default=1000.0, index=True)
     is_active: bool = Field(default=True)
     is_verified: bool = Field(default=False)  # Discord верификация
     created_at: datetime = Field(default_factory=datetime.now)
@@ -81,9 +450,11 @@ class User(SQLModel, table=True):
 
 
 class UserBet(SQLModel, table=True):
+    __table_args__ = {"sqlite_autoincrement": True}
+
     id: Optional[int] = Field(default=None, primary_key=True)
-    user_id: int = Field(foreign_key="user.id")
-    bet_id: int = Field(foreign_key="bet.id")
+    user_id: int = Field(foreign_key="user.id", index=True)
+    bet_id: int = Field(foreign_key="bet.id", index=True)
     selected_option: str
     amount: float
     potential_win: float
@@ -93,6 +464,51 @@ class UserBet(SQLModel, table=True):
     bet: Bet = Relationship(back_populates="user_bets")
 
 
+# Журнал изменений баллов: только добавление, пишется в той же транзакции, что и User.points
+class PointsLedger(SQLModel, table=True):
+    __table_args__ = (Index("ix_pointsledger_user_id_id", "user_id", "id"),)
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    user_id: int = Field(foreign_key="user.id")
+    delta: float
+    reason: str  # initial, discord_bonus, bet_placed, bet_won, settlement_rollback, admin_set, admin_delta
+    bet_id: Optional[int] = Field(default=None, index=True)
+    created_at: datetime = Field(default_factory=datetime.now)
+
+
+# Снимок баланса: balance учитывает все записи журнала пользователя с id <= ledger_id
+class BalanceSnapshot(SQLModel, table=True):
+    id: Optional[int] = Field(default=None, primary_key=True)
+    user_id: int = Field(foreign_key="user.id", index=True)
+    balance: float
+    ledger_id: int = Field(default=0)
+    created_at: datetime = Field(default_factory=datetime.now)
+
+
+# Архив: рассчитанные события и ставки переносятся сюда, чтобы горячие таблицы оставались маленькими
+class ArchivedBet(SQLModel, table=True):
+    id: Optional[int] = Field(default=None, primary_key=True)
+    title: str
+    description: Optional[str] = None
+    options: str = Field(default="[]")
+    created_at: datetime
+    end_time: Optional[datetime] = None
+    winning_option: Optional[str] = None
+    archived_at: datetime = Field(default_factory=datetime.now)
+
+
+class ArchivedUserBet(SQLModel, table=True):
+    id: Optional[int] = Field(default=None, primary_key=True)
+    user_id: int = Field(foreign_key="user.id", index=True)
+    bet_id: int = Field(foreign_key="archivedbet.id", index=True)
+    selected_option: str
+    amount: float
+    potential_win: float
+    is_won: Optional[bool] = None
+    created_at: datetime
+    archived_at: datetime = Field(default_factory=datetime.now)
+
+
 class UserCreate(BaseModel):
     username: str
     email: str
@@ -120,10 +536,32 @@ class BetUpdate(BaseModel):
     end_time: Optional[datetime] = None
 
 
+class BetBulkItem(BetUpdate):
+    id: Optional[int] = None  # Без id событие создаётся, с id обновляется
+
+
+class BetBulkRequest(BaseModel):
+    bets: List[BetBulkItem]
+
+
+class PointsAdjustment(BaseModel):
+    user_id: int
+    value: float
+    mode: Literal["set", "delta"] = "set"
+
+
+class PointsBulkRequest(BaseModel):
+    adjustments: List[PointsAdjustment]
+
+
 class UserBetCreate(BaseModel):
     bet_id: int
     selected_option: str
-    amount: float
+    amount: PositiveFloat  # ноль и отрицательные суммы отклоняются с 422
+
+
+class UserBetsCreate(BaseModel):
+    bets: List[UserBetCreate]
 
 
 class BetComplete(BaseModel):
@@ -137,6 +575,68 @@ class UserRating(BaseModel):
     rank: int
 
 
+# Модели ответов: типизированные схемы сериализуются pydantic-core без jsonable_encoder
+class BetOut(BaseModel):
+    id: int
+    title: str
+    description: Optional[str] = None
+    options: List[BetOption]
+    created_at: datetime
+    end_time: Optional[datetime] = None
+    is_active: bool
+
+
+class AdminBetOut(BetOut):
+    winning_option: Optional[str] = None
+
+
+class UserBetOut(BaseModel):
+    id: int
+    bet_title: str
+    selected_option: str
+    amount: float
+    potential_win: float
+    is_won: Optional[bool] = None
+    created_at: datetime
+
+
+class UserBetHistoryOut(UserBetOut):
+    archived: bool
+
+
+class UserProfile(BaseModel):
+    id: int
+    username: str
+    email: str
+    discord_id: Optional[str] = None
+    points: float
+    is_verified: bool
+    created_at: datetime
+
+
+class AdminUserOut(UserProfile):
+    is_active: bool
+
+
+class PlaceBetResponse(BaseModel):
+    message: str
+    bet_id: int
+    potential_win: float
+    remaining_points: float
+
+
+class PlacedBet(BaseModel):
+    bet_id: int
+    potential_win: float
+
+
+class PlaceBetsResponse(BaseModel):
+    message: str
+    bets: List[PlacedBet]
+    total_amount: float
+    remaining_points: float
+
+
 # Discord верификация модели
 class DiscordVerification(BaseModel):
     user_id: str  # Discord ID
@@ -152,11 +652,97 @@ class DiscordWebhookData(BaseModel):
 
 
 # Создание базы данных
-engine = create_engine(DATABASE_URL)
+def engine_options(url: str) -> dict:
+    """Параметры пула в зависимости от СУБД"""
+    if make_url(url).get_backend_name() == "sqlite":
+        return {}
+    return {
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_pre_ping": True,
+    }
+
+
+def configure_sqlite(target_engine: Engine, read_only: bool = False):
+    """WAL и busy_timeout, чтобы воркеры не падали на блокировке файла"""
+    @event.listens_for(target_engine, "connect")
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        if read_only:
+            cursor.execute("PRAGMA query_only=ON")
+        else:
+            cursor.execute("PRAGMA journal_mode=WAL")
+            cursor.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}")
+        cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+        cursor.close()
+
+
+engine = create_engine(DATABASE_URL, **engine_options(DATABASE_URL))
+if engine.dialect.name == "sqlite":
+    configure_sqlite(engine)
+
+
+def create_read_engine() -> Engine:
+    """Движок для читающих эндпоинтов; без настроек — тот же, что и для записи"""
+    if READ_DATABASE_URL:
+        read_engine = create_engine(READ_DATABASE_URL, **engine_options(READ_DATABASE_URL))
+        if read_engine.dialect.name == "sqlite":
+            configure_sqlite(read_engine, read_only=True)
+        return read_engine
+
+    database = make_url(DATABASE_URL).database
+    if engine.dialect.name == "sqlite" and database and database != ":memory:":
+        # В WAL читатели не блокируют писателя, поэтому отдельный пул снимает конкуренцию за соединения
+        read_engine = create_engine(f"sqlite:///file:{database}?mode=ro&uri=true")
+        configure_sqlite(read_engine, read_only=True)
+        return read_engine
+
+    return engine
+
+
+class ReadRouter:
+    """Выбор движка для чтения с учётом допустимого отставания реплики по маршруту"""
+
+    def __init__(self, primary: Engine, replica: Engine):
+        self.primary = primary
+        self.replica = replica
+        self._lag = 0.0
+        self._lag_checked_at = 0.0
+
+    def replica_lag(self) -> float:
+        if self.replica is self.primary or self.replica.dialect.name != "postgresql":
+            return 0.0
+        if time.monotonic() - self._lag_checked_at < READ_LAG_CHECK_INTERVAL:
+            return self._lag
+        try:
+            with self.replica.connect() as conn:
+                lag = conn.execute(text(
+                    "SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+                    "ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END"
+                )).scalar()
+            self._lag = float(lag or 0)
+        except Exception as e:
+            print(f"Не удалось определить отставание реплики: {e}")
+            self._lag = float("inf")
+        self._lag_checked_at = time.monotonic()
+        return self._lag
+
+    def engine_for(self, route: str) -> Engine:
+        max_staleness = READ_STALENESS.get(route)
+        if max_staleness is None or self.replica is self.primary:
+            return self.primary
+        return self.replica if self.replica_lag() <= max_staleness else self.primary
+
+
+read_engine = create_read_engine()
+read_router = ReadRouter(engine, read_engine)
 
 
 def create_db_and_tables():
     SQLModel.metadata.create_all(engine)
+    run_migrations(engine)
 
 
 def get_session():
@@ -164,6 +750,364 @@ def get_session():
         yield session
 
 
+def read_session(route: str):
+    """Зависимость с сессией на движке для чтения (реплика или основная БД)"""
+    def get_read_session():
+        with Session(read_router.engine_for(route)) as session:
+            yield session
+    return get_read_session
+
+
+def archive_settled_bets(
+        session: Session,
+        older_than_days: int = ARCHIVE_AFTER_DAYS,
+        batch_size: int = ARCHIVE_BATCH_SIZE
+) -> dict:
+    """Перенести рассчитанные события старше older_than_days и их ставки в архив"""
+    cutoff = datetime.now() - timedelta(days=older_than_days)
+    archived_bets = 0
+    archived_wagers = 0
+
+    while True:
+        bets = session.exec(
+            select(Bet).where(
+                Bet.is_active == False,
+                Bet.winning_option != None,
+                func.coalesce(Bet.end_time, Bet.created_at) < cutoff
+            ).order_by(Bet.id).limit(batch_size)
+        ).all()
+        if not bets:
+            break
+
+        now = datetime.now()
+        bet_ids = [bet.id for bet in bets]
+        wagers = session.exec(select(UserBet).where(UserBet.bet_id.in_(bet_ids))).all()
+
+        bet_rows = [{
+            "id": bet.id,
+            "title": bet.title,
+            "description": bet.description,
+            "options": bet.options,
+            "created_at": bet.created_at,
+            "end_time": bet.end_time,
+            "winning_option": bet.winning_option,
+            "archived_at": now
+        } for bet in bets]
+        wager_rows = [{
+            "id": wager.id,
+            "user_id": wager.user_id,
+            "bet_id": wager.bet_id,
+            "selected_option": wager.selected_option,
+            "amount": wager.amount,
+            "potential_win": wager.potential_win,
+            "is_won": wager.is_won,
+            "created_at": wager.created_at,
+            "archived_at": now
+        } for wager in wagers]
+
+        session.expunge_all()
+        session.execute(insert(ArchivedBet), bet_rows)
+        if wager_rows:
+            session.execute(insert(ArchivedUserBet), wager_rows)
+        session.execute(delete(UserBet).where(UserBet.bet_id.in_(bet_ids)))
+        session.execute(delete(Bet).where(Bet.id.in_(bet_ids)))
+        session.commit()
+
+        archived_bets += len(bet_rows)
+        archived_wagers += len(wager_rows)
+
+    return {"archived_bets": archived_bets, "archived_wagers": archived_wagers}
+
+
+def ledger_entry(user_id: int, delta: float, reason: str, bet_id: Optional[int] = None) -> dict:
+    return {
+        "user_id": user_id,
+        "delta": delta,
+        "reason": reason,
+        "bet_id": bet_id,
+        "created_at": datetime.now()
+    }
+
+
+def record_ledger(session: Session, entries: list):
+    """Записать пачку записей журнала одним INSERT (без commit)"""
+    if entries:
+        session.execute(insert(PointsLedger), entries)
+
+
+def snapshot_balances(session: Session) -> int:
+    """Снять балансы пользователей, у которых журнал изменился с прошлого снимка.
+
+    Пользователи без снимка получают его по текущему User.points — так балансы,
+    накопленные до появления журнала, становятся точкой отсчёта.
+    """
+    last_ledger_id = (
+        select(func.coalesce(func.max(PointsLedger.id), 0))
+        .where(PointsLedger.user_id == User.id)
+        .scalar_subquery()
+    )
+    last_snapshot_id = (
+        select(func.coalesce(func.max(BalanceSnapshot.ledger_id), -1))
+        .where(BalanceSnapshot.user_id == User.id)
+        .scalar_subquery()
+    )
+    result = session.execute(
+        insert(BalanceSnapshot).from_select(
+            ["user_id", "balance", "ledger_id", "created_at"],
+            select(User.id, User.points, last_ledger_id, literal(datetime.now()))
+            .where(last_ledger_id > last_snapshot_id)
+        )
+    )
+    session.commit()
+    return result.rowcount
+
+
+def reconstruct_balance(session: Session, user_id: int) -> float:
+    """Баланс = последний снимок + хвост журнала после него"""
+    snapshot = session.exec(
+        select(BalanceSnapshot).where(BalanceSnapshot.user_id == user_id)
+        .order_by(BalanceSnapshot.ledger_id.desc(), BalanceSnapshot.id.desc()).limit(1)
+    ).first()
+    base, after_id = (snapshot.balance, snapshot.ledger_id) if snapshot else (0.0, 0)
+    tail = session.exec(
+        select(func.coalesce(func.sum(PointsLedger.delta), 0.0))
+        .where(PointsLedger.user_id == user_id, PointsLedger.id > after_id)
+    ).one()
+    return base + tail
+
+
+def rollback_settlement(session: Session, bet_id: int) -> Optional[dict]:
+    """Откатить расчёт события: списать выплаты компенсирующими записями журнала.
+
+    Выплаты берутся из выигравших ставок, а не из журнала: у событий, рассчитанных
+    до появления журнала, записей bet_won нет. События seed.py откатывать нельзя —
+    seed.py проставляет is_won, но баллы победителям не начисляет.
+    """
+    bet = session.get(Bet, bet_id)
+    if not bet or bet.winning_option is None:
+        return None
+
+    payouts = session.exec(
+        select(UserBet.user_id, func.sum(UserBet.potential_win))
+        .join(User, User.id == UserBet.user_id)
+        .where(UserBet.bet_id == bet_id, UserBet.is_won == True)
+        .group_by(UserBet.user_id)
+    ).all()
+    payouts = [(user_id, amount) for user_id, amount in payouts if amount]
+
+    if payouts:
+        table = User.__table__
+        session.connection().execute(
+            update(table).where(table.c.id == bindparam("uid")).values(points=table.c.points - bindparam("amount")),
+            [{"uid": user_id, "amount": amount} for user_id, amount in payouts]
+        )
+        record_ledger(session, [
+            ledger_entry(user_id, -amount, "settlement_rollback", bet_id) for user_id, amount in payouts
+        ])
+
+    session.execute(update(UserBet).where(UserBet.bet_id == bet_id).values(is_won=None))
+    bet.winning_option = None
+    session.add(bet)
+    session.commit()
+
+    return {"reverted_users": len(payouts), "reverted_points": sum(amount for _, amount in payouts)}
+
+
+class BetAlreadySettled(Exception):
+    """Событие уже рассчитано; рассчитать заново можно только после rollback_settlement"""
+
+
+def settle_bet(session: Session, bet_id: int, winning_option: str) -> Optional[dict]:
+    """Рассчитать событие: отметить выигрыши и начислить баллы победителям"""
+    bet = session.get(Bet, bet_id)
+    if not bet:
+        return None
+
+    # Условный UPDATE вместо проверки в Python: из двух одновременных расчётов
+    # выплату сделает только один, повторный complete_bet не заплатит второй раз
+    claimed = session.execute(
+        update(Bet)
+        .where(Bet.id == bet_id, Bet.winning_option == None)
+        .values(winning_option=winning_option)
+        .execution_options(synchronize_session=False)
+    )
+    if claimed.rowcount != 1:
+        session.rollback()
+        raise BetAlreadySettled(bet_id)
+
+    bet.winning_option = winning_option
+    bet.is_active = False
+
+    user_bets = session.exec(select(UserBet).where(UserBet.bet_id == bet_id)).all()
+
+    winners_count = 0
+    total_winnings = 0
+    payouts = []
+
+    for user_bet in user_bets:
+        if user_bet.selected_option == winning_option:
+            user_bet.is_won = True
+            user = session.get(User, user_bet.user_id)
+            if user:
+                user.points += user_bet.potential_win
+                session.add(user)
+                payouts.append(ledger_entry(user.id, user_bet.potential_win, "bet_won", bet_id))
+            winners_count += 1
+            total_winnings += user_bet.potential_win
+        else:
+            user_bet.is_won = False
+
+        session.add(user_bet)
+
+    session.add(bet)
+    record_ledger(session, payouts)
+    session.commit()
+
+    return {"winners_count": winners_count, "total_winnings": total_winnings}
+
+
+def to_local_naive(value: Optional[datetime]) -> Optional[datetime]:
+    """end_time хранится в локальном времени без tzinfo, как datetime.now()"""
+    if value is not None and value.tzinfo is not None:
+        return value.astimezone().replace(tzinfo=None)
+    return value
+
+
+class BetScheduler:
+    """Закрытие ставок ровно в end_time по min-heap дедлайнов.
+
+    Каждый воркер держит свою кучу; закрытие — условный UPDATE, поэтому
+    событие закрывает (и рассчитывает) только тот воркер, чей UPDATE сработал.
+    """
+
+    def __init__(self):
+        self._heap = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def schedule(self, when: datetime, bet_id: int, action: str = "close", attempt: int = 0):
+        heapq.heappush(self._heap, (to_local_naive(when), bet_id, action, attempt))
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def track(self, bet: Bet):
+        """Поставить событие в очередь, если у него есть дедлайн"""
+        if bet.is_active and bet.end_time is not None:
+            self.schedule(bet.end_time, bet.id)
+
+    def load(self):
+        """Восстановить кучу из БД при старте"""
+        with Session(engine) as session:
+            rows = session.exec(
+                select(Bet.id, Bet.end_time).where(Bet.is_active == True, Bet.end_time != None)
+            ).all()
+        self._heap = [(to_local_naive(end_time), bet_id, "close", 0) for bet_id, end_time in rows]
+        heapq.heapify(self._heap)
+
+    def start(self):
+        if self._task is not None:
+            return
+        self.load()
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            while self._heap and self._heap[0][0] <= datetime.now():
+                _, bet_id, action, attempt = heapq.heappop(self._heap)
+                try:
+                    if action == "close":
+                        closed = await asyncio.to_thread(close_expired_bet, bet_id)
+                        if closed and RESULT_SOURCE_URL:
+                            await self._settle(bet_id, 0)
+                    else:
+                        await self._settle(bet_id, attempt)
+                except Exception as e:
+                    print(f"Ошибка планировщика для ставки {bet_id}: {e}")
+
+            timeout = None
+            if self._heap:
+                timeout = max((self._heap[0][0] - datetime.now()).total_seconds(), 0)
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _settle(self, bet_id: int, attempt: int):
+        winning_option = await fetch_bet_result(bet_id)
+        if winning_option is None:
+            if attempt + 1 < SETTLE_MAX_ATTEMPTS:
+                retry_at = datetime.now() + timedelta(seconds=SETTLE_RETRY_SECONDS)
+                self.schedule(retry_at, bet_id, "settle", attempt + 1)
+            return
+        await asyncio.to_thread(settle_unsettled_bet, bet_id, winning_option)
+
+
+def close_expired_bet(bet_id: int) -> bool:
+    """Условно деактивировать ставку; True, если закрыл именно этот вызов"""
+    with Session(engine) as session:
+        result = session.execute(
+            update(Bet)
+            .where(Bet.id == bet_id, Bet.is_active == True, Bet.end_time <= datetime.now())
+            .values(is_active=False)
+        )
+        session.commit()
+        return result.rowcount == 1
+
+
+def settle_unsettled_bet(bet_id: int, winning_option: str):
+    with Session(engine) as session:
+        bet = session.get(Bet, bet_id)
+        if bet and bet.winning_option is None:
+            try:
+                settle_bet(session, bet_id, winning_option)
+            except BetAlreadySettled:
+                pass  # успел рассчитать другой воркер или администратор
+
+
+async def fetch_bet_result(bet_id: int) -> Optional[str]:
+    """Запросить результат события у внешнего источника"""
+    try:
+        response = await get_http_client().get(f"{RESULT_SOURCE_URL.rstrip('/')}/{bet_id}")
+        if response.status_code != 200:
+            return None
+        return response.json().get("winning_option")
+    except (httpx.HTTPError, ValueError):
+        return None
+
+
+bet_scheduler = BetScheduler()
+
+
+def run_balance_snapshots():
+    with Session(engine) as session:
+        snapshot_balances(session)
+
+
+async def balance_snapshot_loop():
+    """Периодические снимки балансов; повторный снимок в другом воркере безвреден"""
+    while True:
+        await asyncio.sleep(BALANCE_SNAPSHOT_INTERVAL)
+        try:
+            await asyncio.to_thread(run_balance_snapshots)
+        except Exception as e:
+            print(f"Ошибка снимка балансов: {e}")
+
+
+background_tasks = []
+
+
 # Утилиты для безопасности (остаются те же)
 def verify_password(plain_password, hashed_password):
     return pwd_context.verify(plain_password, hashed_password)
@@ -185,27 +1129,34 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
 
 
 def check_rate_limit(ip: str, max_attempts: int = 5, window: int = 300) -> bool:
-    if not REDIS_AVAILABLE:
+    redis_client = redis_manager.get_client()
+    if redis_client is None:
         return True
 
+    # SET NX + INCR в одной транзакции: счётчик атомарен между воркерами
     key = f"rate_limit:{ip}"
-    current = redis_client.get(key)
-
-    if current is None:
-        redis_client.setex(key, window, 1)
+    try:
+        pipe = redis_client.pipeline()
+        pipe.set(key, 0, ex=window, nx=True)
+        pipe.incr(key)
+        _, attempts = pipe.execute()
+    except redis.RedisError:
+        redis_manager.mark_failed()
         return True
 
-    if int(current) >= max_attempts:
-        return False
-
-    redis_client.incr(key)
-    return True
+    return attempts <= max_attempts
 
 
 def reset_rate_limit(ip: str):
-    if REDIS_AVAILABLE:
-        key = f"rate_limit:{ip}"
+    redis_client = redis_manager.get_client()
+    if redis_client is None:
+        return
+
+    key = f"rate_limit:{ip}"
+    try:
         redis_client.delete(key)
+    except redis.RedisError:
+        redis_manager.mark_failed()
 
 
 # Зависимости для аутентификации (остаются те же)
@@ -242,7 +1193,7 @@ async def verify_admin_token(credentials: HTTPAuthorizationCredentials = Depends
 
 
 # FastAPI приложение
-app = FastAPI(title="Betting System API", version="1.0.0")
+app = FastAPI(title="Betting System API", version="1.0.0", default_response_class=ORJSONResponse)
 
 # CORS middleware
 app.add_middleware(
@@ -253,27 +1204,326 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Подключаем статические файлы (фронтенд)
-if os.path.exists("/var/www/betting-system/frontend"):
-    app.mount("/static", StaticFiles(directory="/var/www/betting-system/frontend"), name="static")
+class IdempotencyMiddleware:
+    """Повтор POST с тем же Idempotency-Key получает сохранённый ответ без обращения к БД.
+
+    Ключ привязан к пути и заголовку Authorization; тело запроса сверяется по хешу.
+    Ответы 5xx не сохраняются, чтобы повтор мог пройти заново.
+    """
+
+    def __init__(self, app, paths: set = IDEMPOTENT_PATHS):
+        self.app = app
+        self.paths = paths
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST" or scope["path"] not in self.paths:
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope["headers"])
+        idempotency_key = headers.get(b"idempotency-key")
+        if not idempotency_key:
+            await self.app(scope, receive, send)
+            return
+
+        body = b""
+        more_body = True
+        while more_body:
+            message = await receive()
+            body += message.get("body", b"")
+            more_body = message.get("more_body", False)
+
+        scope_hash = hashlib.sha256(
+            scope["path"].encode() + b"\0" + headers.get(b"authorization", b"") + b"\0" + idempotency_key
+        ).hexdigest()
+        key = f"idempotency:{scope_hash}"
+        fingerprint = hashlib.sha256(body).hexdigest()
+
+        record = idempotency_store.begin(key, fingerprint)
+        if record is not None:
+            if record["fingerprint"] != fingerprint:
+                await self._send_json(send, 422, {"detail": "Idempotency-Key reused with a different request"})
+            elif record["state"] == "pending":
+                await self._send_json(send, 409, {"detail": "Request with this Idempotency-Key is in progress"})
+            else:
+                await self._replay(send, record)
+            return
+
+        body_sent = False
+
+        async def replay_receive():
+            nonlocal body_sent
+            if not body_sent:
+                body_sent = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            return await receive()
+
+        response = {"status": 500, "headers": [], "body": b""}
+
+        async def capture_send(message):
+            if message["type"] == "http.response.start":
+                response["status"] = message["status"]
+                response["headers"] = message.get("headers", [])
+            elif message["type"] == "http.response.body":
+                response["body"] += message.get("body", b"")
+            await send(message)
+
+        try:
+            await self.app(scope, replay_receive, capture_send)
+        except Exception:
+            idempotency_store.release(key)
+            raise
+
+        if response["status"] >= 500:
+            idempotency_store.release(key)
+            return
+
+        idempotency_store.complete(key, {
+            "fingerprint": fingerprint,
+            "status": response["status"],
+            "headers": [
+                [name.decode("latin-1"), value.decode("latin-1")]
+                for name, value in response["headers"]
+                if name.lower() not in (b"content-length", b"set-cookie")
+            ],
+            "body": base64.b64encode(response["body"]).decode("ascii")
+        })
+
+    @staticmethod
+    async def _replay(send, record: dict):
+        body = base64.b64decode(record["body"])
+        headers = [(name.encode("latin-1"), value.encode("latin-1")) for name, value in record["headers"]]
+        headers.append((b"content-length", str(len(body)).encode()))
+        headers.append((b"idempotent-replayed", b"true"))
+        await send({"type": "http.response.start", "status": record["status"], "headers": headers})
+        await send({"type": "http.response.body", "body": body})
+
+    @staticmethod
+    async def _send_json(send, status_code: int, content: dict):
+        body = json.dumps(content).encode()
+        await send({
+            "type": "http.response.start",
+            "status": status_code,
+            "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]
+        })
+        await send({"type": "http.response.body", "body": body})
+
+
+# Добавляется раньше сжатия, чтобы хранить и отдавать несжатый ответ
+app.add_middleware(IdempotencyMiddleware)
+
+
+class BrotliResponder:
+    """Brotli-сжатие одного ответа, по образцу GZipResponder из Starlette"""
+
+    def __init__(self, app, minimum_size: int):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.send = None
+        self.initial_message = {}
+        self.started = False
+        self.content_encoding_set = False
+        self.compressor = brotli.Compressor(quality=BROTLI_API_QUALITY)
+
+    async def __call__(self, scope, receive, send):
+        self.send = send
+        await self.app(scope, receive, self.send_with_brotli)
+
+    def _compressed_headers(self) -> MutableHeaders:
+        headers = MutableHeaders(raw=self.initial_message["headers"])
+        headers["Content-Encoding"] = "br"
+        headers.add_vary_header("Accept-Encoding")
+        return headers
+
+    async def send_with_brotli(self, message):
+        message_type = message["type"]
+        if message_type == "http.response.start":
+            # Заголовки уходят вместе с первым куском тела, когда известен его размер
+            self.initial_message = message
+            self.content_encoding_set = "content-encoding" in Headers(raw=message["headers"])
+            return
+        if message_type != "http.response.body":
+            await self.send(message)
+            return
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+
+        if self.content_encoding_set:
+            if not self.started:
+                self.started = True
+                await self.send(self.initial_message)
+            await self.send(message)
+        elif not self.started:
+            self.started = True
+            if len(body) < self.minimum_size and not more_body:
+                await self.send(self.initial_message)
+                await self.send(message)
+                return
+            headers = self._compressed_headers()
+            if more_body:
+                del headers["Content-Length"]
+                message["body"] = self.compressor.process(body) + self.compressor.flush()
+            else:
+                message["body"] = self.compressor.process(body) + self.compressor.finish()
+                headers["Content-Length"] = str(len(message["body"]))
+            await self.send(self.initial_message)
+            await self.send(message)
+        else:
+            tail = self.compressor.flush() if more_body else self.compressor.finish()
+            message["body"] = self.compressor.process(body) + tail
+            await self.send(message)
+
+
+class APICompressionMiddleware(GZipMiddleware):
+    """Brotli (если установлен и клиент его принимает) или gzip для ответов API;
+    статика отдаётся уже сжатой и сюда не попадает"""
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and (scope["path"] == "/" or scope["path"].startswith("/static/")):
+            await self.app(scope, receive, send)
+            return
+        if scope["type"] == "http" and brotli is not None:
+            if "br" in accepted_encodings(Headers(scope=scope).get("accept-encoding", "")):
+                await BrotliResponder(self.app, self.minimum_size)(scope, receive, send)
+                return
+        await super().__call__(scope, receive, send)
+
+
+app.add_middleware(APICompressionMiddleware, minimum_size=COMPRESSION_MIN_SIZE)
+
+
+# Статические файлы (фронтенд): читаются и сжимаются один раз при старте
+class StaticAsset:
+    def __init__(self, path: str):
+        with open(path, "rb") as f:
+            self.body = f.read()
+        self.media_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+        digest = hashlib.sha256(self.body).hexdigest()[:32]
+        self.etags = {"identity": f'"{digest}"'}
+        self.encoded = {}
+
+        if len(self.body) >= COMPRESSION_MIN_SIZE:
+            candidates = {"gzip": gzip.compress(self.body, compresslevel=9, mtime=0)}
+            if brotli is not None:
+                candidates["br"] = brotli.compress(self.body, quality=11)
+            for encoding, data in candidates.items():
+                if len(data) < len(self.body):
+                    self.encoded[encoding] = data
+                    self.etags[encoding] = f'"{digest}-{encoding}"'
+
+
+static_assets = {}
+
+
+def load_static_assets(directory: str = FRONTEND_DIR):
+    static_assets.clear()
+    if not os.path.isdir(directory):
+        return
+    for root, _, files in os.walk(directory):
+        for name in files:
+            path = os.path.join(root, name)
+            relative = os.path.relpath(path, directory).replace(os.sep, "/")
+            static_assets[relative] = StaticAsset(path)
+
+
+def accepted_encodings(header: str) -> set:
+    """Кодировки из Accept-Encoding с ненулевым q"""
+    encodings = set()
+    for part in header.split(","):
+        token, *params = [item.strip() for item in part.split(";")]
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if token and quality > 0:
+            encodings.add(token.lower())
+    return encodings
+
+
+def static_response(request: Request, asset: StaticAsset, cache_control: str) -> Response:
+    accepted = accepted_encodings(request.headers.get("accept-encoding", ""))
+    encoding = next((name for name in ("br", "gzip") if name in asset.encoded and name in accepted), "identity")
+    headers = {
+        "ETag": asset.etags[encoding],
+        "Cache-Control": cache_control,
+        "Vary": "Accept-Encoding",
+    }
+
+    if_none_match = request.headers.get("if-none-match", "")
+    if if_none_match:
+        tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+        if asset.etags[encoding] in tags or "*" in tags:
+            return Response(status_code=304, headers=headers)
+
+    if encoding != "identity":
+        headers["Content-Encoding"] = encoding
+        return Response(asset.encoded[encoding], media_type=asset.media_type, headers=headers)
+    return Response(asset.body, media_type=asset.media_type, headers=headers)
+
+
+@app.get("/static/{path:path}", include_in_schema=False)
+async def read_static(path: str, request: Request):
+    asset = static_assets.get(path)
+    if asset is None:
+        raise HTTPException(status_code=404, detail="Not found")
+    return static_response(request, asset, f"public, max-age={STATIC_MAX_AGE}")
 
 
 @app.on_event("startup")
 def on_startup():
     create_db_and_tables()
+    load_static_assets()
+    redis_manager.start()
+
+
+@app.on_event("startup")
+async def start_background_jobs():
+    if BET_SCHEDULER_ENABLED:
+        bet_scheduler.start()
+    if BALANCE_SNAPSHOT_INTERVAL > 0:
+        background_tasks.append(asyncio.create_task(balance_snapshot_loop()))
+    if VERIFICATION_TRANSPORT == "bus":
+        verification_bus.start()
+
+
+@app.on_event("shutdown")
+def on_shutdown():
+    redis_manager.stop()
+
+
+@app.on_event("shutdown")
+async def stop_background_jobs():
+    await bet_scheduler.stop()
+    await verification_bus.stop()
+    for task in background_tasks:
+        task.cancel()
+    background_tasks.clear()
+    await close_http_client()
 
 
 # Health check
 @app.get("/health")
 async def health_check():
-    return {"status": "healthy", "timestamp": datetime.now()}
+    return {
+        "status": "healthy",
+        "timestamp": datetime.now(),
+        "redis": redis_manager.available,
+        "discord_bot": discord_bot_breaker.status()
+    }
 
 
 # Главная страница
 @app.get("/")
-async def read_index():
-    if os.path.exists("/var/www/betting-system/frontend/index.html"):
-        return FileResponse('/var/www/betting-system/frontend/index.html')
+async def read_index(request: Request):
+    asset = static_assets.get("index.html")
+    if asset is not None:
+        # index.html не версионируется, поэтому браузер всегда перепроверяет его по ETag
+        return static_response(request, asset, "no-cache")
     return {"message": "API is running"}
 
 
@@ -293,38 +1543,75 @@ async def link_discord_account(
     if existing and existing.id != current_user.id:
         raise HTTPException(status_code=400, detail="Discord account already linked to another user")
 
+    # Ключ идемпотентности детерминирован, чтобы повторная привязка не ломалась на "Key already used"
+    idempotency_key = hashlib.sha256(
+        f"{verification_data.user_id}:{verification_data.key}".encode()
+    ).hexdigest()[:32]
+
+    # Пока бот недоступен, отвечаем сразу, не занимая соединения и воркеры ожиданием
+    if not discord_bot_breaker.allow():
+        raise HTTPException(status_code=503, detail="Discord bot is temporarily unavailable, try again later")
+
+    payload = {
+        "discord_id": verification_data.user_id,
+        "key": verification_data.key,
+        "role_type": "member"
+    }
+
     # Отправляем запрос к Discord боту для верификации
-    async with httpx.AsyncClient() as client:
-        try:
-            response = await client.post(
+    try:
+        if VERIFICATION_TRANSPORT == "bus":
+            status_code, _ = await verification_bus.request({**payload, "idempotency_key": idempotency_key})
+        else:
+            # Секрет передаётся только по HTTP: сообщения шины хранятся в потоке Redis
+            response = await get_http_client().post(
                 DISCORD_WEBHOOK_URL,
-                json={
-                    "discord_id": verification_data.user_id,
-                    "key": verification_data.key,
-                    "role_type": "member",
-                    "secret": DISCORD_WEBHOOK_SECRET
-                }
+                json={**payload, "secret": DISCORD_WEBHOOK_SECRET},
+                headers={"Idempotency-Key": idempotency_key}
             )
+            status_code = response.status_code
+    except (httpx.HTTPError, redis.RedisError, asyncio.TimeoutError) as e:
+        discord_bot_breaker.record_failure()
+        raise HTTPException(status_code=503, detail=f"Failed to verify with Discord bot: {str(e) or 'timeout'}")
+
+    if status_code >= 500:
+        discord_bot_breaker.record_failure()
+        raise HTTPException(status_code=503, detail="Failed to verify with Discord bot")
+
+    discord_bot_breaker.record_success()
+
+    if status_code != 200:
+        raise HTTPException(status_code=400, detail="Discord verification failed")
+
+    # Бонус выплачивается один раз на пользователя, признак — запись discord_bonus в журнале
+    # (аккаунтам, верифицированным до журнала, её проставила миграция 003). Повтор ключа и
+    # перепривязка на другой Discord ID второй выплаты не дают, а webhook бота, успевший
+    # выставить is_verified, не отменяет первую. Условие проверяется в том же UPDATE
+    bonus_paid = select(PointsLedger.id).where(
+        PointsLedger.user_id == User.id, PointsLedger.reason == "discord_bonus"
+    ).exists()
+    result = session.execute(
+        update(User)
+        .where(User.id == current_user.id, ~bonus_paid)
+        .values(points=User.points + 500)
+        .execution_options(synchronize_session=False)
+    )
+    bonus_points = 500 if result.rowcount == 1 else 0
+    if bonus_points:
+        record_ledger(session, [ledger_entry(current_user.id, bonus_points, "discord_bonus")])
 
-            if response.status_code == 200:
-                # Обновляем пользователя
-                current_user.discord_id = verification_data.user_id
-                current_user.is_verified = True
-                current_user.points += 500  # Бонус за верификацию
-
-                session.add(current_user)
-                session.commit()
-
-                return {
-                    "message": "Discord account linked successfully",
-                    "bonus_points": 500,
-                    "total_points": current_user.points
-                }
-            else:
-                raise HTTPException(status_code=400, detail="Discord verification failed")
+    # Привязка записывается всегда: бот уже выдал роль этому Discord ID
+    current_user.discord_id = verification_data.user_id
+    current_user.is_verified = True
+    session.add(current_user)
+    session.commit()
+    session.refresh(current_user)
 
-        except Exception as e:
-            raise HTTPException(status_code=500, detail=f"Failed to verify with Discord bot: {str(e)}")
+    return {
+        "message": "Discord account linked successfully",
+        "bonus_points": bonus_points,
+        "total_points": current_user.points
+    }
 
 
 @app.post("/webhook/discord-verified", response_model=dict)
@@ -378,6 +1665,8 @@ async def register_user(
         hashed_password=hashed_password
     )
     session.add(user)
+    session.flush()
+    record_ledger(session, [ledger_entry(user.id, user.points, "initial")])
     session.commit()
     session.refresh(user)
 
@@ -425,41 +1714,40 @@ async def login_user(
     }
 
 
-@app.get("/profile", response_model=dict)
+@app.get("/profile", response_model=UserProfile)
 async def get_user_profile(current_user: User = Depends(get_current_user)):
-    return {
-        "id": current_user.id,
-        "username": current_user.username,
-        "email": current_user.email,
-        "discord_id": current_user.discord_id,
-        "points": current_user.points,
-        "is_verified": current_user.is_verified,
-        "created_at": current_user.created_at
-    }
+    return UserProfile(
+        id=current_user.id,
+        username=current_user.username,
+        email=current_user.email,
+        discord_id=current_user.discord_id,
+        points=current_user.points,
+        is_verified=current_user.is_verified,
+        created_at=current_user.created_at
+    )
 
 
 # Остальные эндпоинты остаются без изменений...
-@app.get("/bets", response_model=List[dict])
-async def get_active_bets(session: Session = Depends(get_session)):
+@app.get("/bets", response_model=List[BetOut])
+async def get_active_bets(session: Session = Depends(read_session("bets"))):
     bets = session.exec(select(Bet).where(Bet.is_active == True)).all()
     result = []
 
     for bet in bets:
-        bet_dict = {
-            "id": bet.id,
-            "title": bet.title,
-            "description": bet.description,
-            "options": bet.get_options(),
-            "created_at": bet.created_at,
-            "end_time": bet.end_time,
-            "is_active": bet.is_active
-        }
-        result.append(bet_dict)
+        result.append(BetOut(
+            id=bet.id,
+            title=bet.title,
+            description=bet.description,
+            options=bet.get_options(),
+            created_at=bet.created_at,
+            end_time=bet.end_time,
+            is_active=bet.is_active
+        ))
 
     return result
 
 
-@app.post("/place_bet", response_model=dict)
+@app.post("/place_bet", response_model=PlaceBetResponse)
 async def place_bet(
         bet_data: UserBetCreate,
         current_user: User = Depends(get_current_user),
@@ -505,18 +1793,97 @@ async def place_bet(
 
     session.add(user_bet)
     session.add(current_user)
+    record_ledger(session, [ledger_entry(current_user.id, -bet_data.amount, "bet_placed", bet_data.bet_id)])
     session.commit()
     session.refresh(user_bet)
 
-    return {
-        "message": "Bet placed successfully",
-        "bet_id": user_bet.id,
-        "potential_win": potential_win,
-        "remaining_points": current_user.points
+    return PlaceBetResponse(
+        message="Bet placed successfully",
+        bet_id=user_bet.id,
+        potential_win=potential_win,
+        remaining_points=current_user.points
+    )
+
+
+@app.post("/place_bets", response_model=PlaceBetsResponse)
+async def place_bets(
+        bets_data: UserBetsCreate,
+        current_user: User = Depends(get_current_user),
+        session: Session = Depends(get_session)
+):
+    """Несколько ставок за один запрос и одну транзакцию"""
+    if not current_user.is_verified:
+        raise HTTPException(
+            status_code=403,
+            detail="Please verify your Discord account to place bets"
+        )
+
+    if not bets_data.bets:
+        raise HTTPException(status_code=400, detail="No bets provided")
+
+    if len(bets_data.bets) > MAX_BATCH_BETS:
+        raise HTTPException(status_code=400, detail=f"Too many bets, maximum is {MAX_BATCH_BETS}")
+
+    bet_ids = {bet_data.bet_id for bet_data in bets_data.bets}
+    bets = {bet.id: bet for bet in session.exec(select(Bet).where(Bet.id.in_(bet_ids))).all()}
+    options_by_bet = {
+        bet_id: {option.name: option for option in bet.get_options()}
+        for bet_id, bet in bets.items()
     }
 
+    now = datetime.now()
+    total_amount = 0
+    user_bets = []
+
+    for index, bet_data in enumerate(bets_data.bets):
+        bet = bets.get(bet_data.bet_id)
+        if not bet or not bet.is_active:
+            raise HTTPException(status_code=404, detail=f"Bet #{index}: bet not found or inactive")
+
+        if bet.end_time and now > bet.end_time:
+            raise HTTPException(status_code=400, detail=f"Bet #{index}: betting period has ended")
+
+        selected_option_data = options_by_bet[bet.id].get(bet_data.selected_option)
+        if not selected_option_data:
+            raise HTTPException(status_code=400, detail=f"Bet #{index}: invalid bet option")
+
+        total_amount += bet_data.amount
+        user_bets.append(UserBet(
+            user_id=current_user.id,
+            bet_id=bet_data.bet_id,
+            selected_option=bet_data.selected_option,
+            amount=bet_data.amount,
+            potential_win=bet_data.amount * selected_option_data.coefficient
+        ))
 
-@app.get("/my_bets", response_model=List[dict])
+    if current_user.points < total_amount:
+        raise HTTPException(status_code=400, detail="Insufficient points")
+
+    current_user.points -= total_amount
+
+    session.add_all(user_bets)
+    session.add(current_user)
+    record_ledger(session, [
+        ledger_entry(current_user.id, -user_bet.amount, "bet_placed", user_bet.bet_id)
+        for user_bet in user_bets
+    ])
+    session.flush()
+    placed = [
+        PlacedBet(bet_id=user_bet.id, potential_win=user_bet.potential_win)
+        for user_bet in user_bets
+    ]
+    remaining_points = current_user.points
+    session.commit()
+
+    return PlaceBetsResponse(
+        message="Bets placed successfully",
+        bets=placed,
+        total_amount=total_amount,
+        remaining_points=remaining_points
+    )
+
+
+@app.get("/my_bets", response_model=List[UserBetOut])
 async def get_user_bets(
         current_user: User = Depends(get_current_user),
         session: Session = Depends(get_session)
@@ -525,19 +1892,71 @@ async def get_user_bets(
         select(UserBet).where(UserBet.user_id == current_user.id)
     ).all()
 
+    titles = {}
+    bet_ids = {user_bet.bet_id for user_bet in user_bets}
+    if bet_ids:
+        titles = dict(session.exec(select(Bet.id, Bet.title).where(Bet.id.in_(bet_ids))).all())
+
     result = []
     for user_bet in user_bets:
-        bet_info = session.get(Bet, user_bet.bet_id)
-        bet_dict = {
-            "id": user_bet.id,
-            "bet_title": bet_info.title if bet_info else "Unknown",
-            "selected_option": user_bet.selected_option,
-            "amount": user_bet.amount,
-            "potential_win": user_bet.potential_win,
-            "is_won": user_bet.is_won,
-            "created_at": user_bet.created_at
-        }
-        result.append(bet_dict)
+        result.append(UserBetOut(
+            id=user_bet.id,
+            bet_title=titles.get(user_bet.bet_id, "Unknown"),
+            selected_option=user_bet.selected_option,
+            amount=user_bet.amount,
+            potential_win=user_bet.potential_win,
+            is_won=user_bet.is_won,
+            created_at=user_bet.created_at
+        ))
+
+    return result
+
+
+@app.get("/my_bets/history", response_model=List[UserBetHistoryOut])
+async def get_user_bet_history(
+        limit: int = 100,
+        offset: int = 0,
+        current_user: User = Depends(get_current_user),
+        session: Session = Depends(get_session)
+):
+    """Полная история ставок: горячие таблицы и архив"""
+    window = offset + limit
+    hot = session.exec(
+        select(UserBet).where(UserBet.user_id == current_user.id)
+        .order_by(UserBet.created_at.desc()).limit(window)
+    ).all()
+    archived = session.exec(
+        select(ArchivedUserBet).where(ArchivedUserBet.user_id == current_user.id)
+        .order_by(ArchivedUserBet.created_at.desc()).limit(window)
+    ).all()
+
+    hot_titles = {}
+    hot_bet_ids = {user_bet.bet_id for user_bet in hot}
+    if hot_bet_ids:
+        hot_titles = dict(session.exec(select(Bet.id, Bet.title).where(Bet.id.in_(hot_bet_ids))).all())
+    archived_titles = {}
+    archived_bet_ids = {user_bet.bet_id for user_bet in archived}
+    if archived_bet_ids:
+        archived_titles = dict(session.exec(
+            select(ArchivedBet.id, ArchivedBet.title).where(ArchivedBet.id.in_(archived_bet_ids))
+        ).all())
+
+    entries = [(user_bet, hot_titles, False) for user_bet in hot]
+    entries += [(user_bet, archived_titles, True) for user_bet in archived]
+    entries.sort(key=lambda entry: entry[0].created_at, reverse=True)
+
+    result = []
+    for user_bet, titles, is_archived in entries[offset:window]:
+        result.append(UserBetHistoryOut(
+            id=user_bet.id,
+            bet_title=titles.get(user_bet.bet_id, "Unknown"),
+            selected_option=user_bet.selected_option,
+            amount=user_bet.amount,
+            potential_win=user_bet.potential_win,
+            is_won=user_bet.is_won,
+            created_at=user_bet.created_at,
+            archived=is_archived
+        ))
 
     return result
 
@@ -545,7 +1964,7 @@ async def get_user_bets(
 @app.get("/leaderboard", response_model=List[UserRating])
 async def get_leaderboard(
         limit: int = 10,
-        session: Session = Depends(get_session)
+        session: Session = Depends(read_session("leaderboard"))
 ):
     users = session.exec(
         select(User).where(User.is_active == True).order_by(User.points.desc()).limit(limit)
@@ -571,13 +1990,14 @@ async def create_bet(
     bet = Bet(
         title=bet_data.title,
         description=bet_data.description,
-        end_time=bet_data.end_time
+        end_time=to_local_naive(bet_data.end_time)
     )
     bet.set_options(bet_data.options)
 
     session.add(bet)
     session.commit()
     session.refresh(bet)
+    bet_scheduler.track(bet)
 
     return {"message": "Bet created successfully", "bet_id": bet.id}
 
@@ -601,10 +2021,12 @@ async def update_bet(
     if bet_data.is_active is not None:
         bet.is_active = bet_data.is_active
     if bet_data.end_time is not None:
-        bet.end_time = bet_data.end_time
+        bet.end_time = to_local_naive(bet_data.end_time)
 
     session.add(bet)
     session.commit()
+    if bet_data.end_time is not None or bet_data.is_active:
+        bet_scheduler.track(bet)
 
     return {"message": "Bet updated successfully"}
 
@@ -614,80 +2036,252 @@ async def complete_bet(
         completion_data: BetComplete,
         session: Session = Depends(get_session)
 ):
-    bet = session.get(Bet, completion_data.bet_id)
-    if not bet:
+    try:
+        result = settle_bet(session, completion_data.bet_id, completion_data.winning_option)
+    except BetAlreadySettled:
+        raise HTTPException(status_code=409, detail="Bet is already settled, roll back the settlement first")
+    if result is None:
         raise HTTPException(status_code=404, detail="Bet not found")
 
-    bet.winning_option = completion_data.winning_option
-    bet.is_active = False
+    return {
+        "message": "Bet completed successfully",
+        "winners_count": result["winners_count"],
+        "total_winnings": result["total_winnings"]
+    }
 
-    user_bets = session.exec(select(UserBet).where(UserBet.bet_id == completion_data.bet_id)).all()
 
-    winners_count = 0
-    total_winnings = 0
+def chunked(items: list, size: int = BULK_CHUNK_SIZE):
+    for start in range(0, len(items), size):
+        yield start, items[start:start + size]
 
-    for user_bet in user_bets:
-        if user_bet.selected_option == completion_data.winning_option:
-            user_bet.is_won = True
-            user = session.get(User, user_bet.user_id)
-            if user:
-                user.points += user_bet.potential_win
-                session.add(user)
-            winners_count += 1
-            total_winnings += user_bet.potential_win
-        else:
-            user_bet.is_won = False
 
-        session.add(user_bet)
+@app.post("/admin/bulk_bets", response_model=dict, dependencies=[Depends(verify_admin_token)])
+async def bulk_bets(
+        bulk_data: BetBulkRequest,
+        session: Session = Depends(get_session)
+):
+    """Массовое создание и обновление событий"""
+    results = []
+
+    for start, chunk in chunked(bulk_data.bets):
+        existing_ids = {item.id for item in chunk if item.id is not None}
+        existing = {}
+        if existing_ids:
+            existing = {bet.id: bet for bet in session.exec(select(Bet).where(Bet.id.in_(existing_ids))).all()}
+
+        created = []
+        for index, item in enumerate(chunk, start):
+            if item.id is None:
+                if not item.title or not item.options:
+                    results.append({"index": index, "status": "error", "detail": "Title and options are required"})
+                    continue
+                bet = Bet(
+                    title=item.title,
+                    description=item.description,
+                    end_time=to_local_naive(item.end_time),
+                    is_active=item.is_active if item.is_active is not None else True
+                )
+                bet.set_options(item.options)
+                session.add(bet)
+                created.append((index, bet))
+                continue
+
+            bet = existing.get(item.id)
+            if not bet:
+                results.append({"index": index, "status": "error", "bet_id": item.id, "detail": "Bet not found"})
+                continue
+
+            if item.title is not None:
+                bet.title = item.title
+            if item.description is not None:
+                bet.description = item.description
+            if item.options is not None:
+                bet.set_options(item.options)
+            if item.is_active is not None:
+                bet.is_active = item.is_active
+            if item.end_time is not None:
+                bet.end_time = to_local_naive(item.end_time)
+            session.add(bet)
+            results.append({"index": index, "status": "updated", "bet_id": bet.id})
+            if item.end_time is not None or item.is_active:
+                bet_scheduler.track(bet)
+
+        session.flush()
+        for index, bet in created:
+            results.append({"index": index, "status": "created", "bet_id": bet.id})
+            bet_scheduler.track(bet)
+        session.commit()
 
-    session.add(bet)
-    session.commit()
+    results.sort(key=lambda result: result["index"])
+    return {
+        "created": sum(1 for result in results if result["status"] == "created"),
+        "updated": sum(1 for result in results if result["status"] == "updated"),
+        "failed": sum(1 for result in results if result["status"] == "error"),
+        "results": results
+    }
+
+
+@app.post("/admin/bulk_update_points", response_model=dict, dependencies=[Depends(verify_admin_token)])
+async def bulk_update_points(
+        bulk_data: PointsBulkRequest,
+        session: Session = Depends(get_session)
+):
+    """Массовое изменение баллов: абсолютное значение (set) или приращение (delta)"""
+    set_stmt = update(User.__table__).where(User.__table__.c.id == bindparam("uid")).values(
+        points=bindparam("value")
+    )
+    delta_stmt = update(User.__table__).where(User.__table__.c.id == bindparam("uid")).values(
+        points=User.__table__.c.points + bindparam("value")
+    )
+    results = []
+
+    for start, chunk in chunked(bulk_data.adjustments):
+        user_ids = {item.user_id for item in chunk}
+        balances = dict(session.exec(select(User.id, User.points).where(User.id.in_(user_ids))).all())
+        found = set(balances)
+
+        entries = []
+        item_points = {}  # позиция в запросе -> баланс сразу после этой операции
+        for index, item in enumerate(chunk, start):
+            if item.user_id not in found:
+                continue
+            if item.mode == "set":
+                entries.append(ledger_entry(item.user_id, item.value - balances[item.user_id], "admin_set"))
+                balances[item.user_id] = item.value
+            else:
+                entries.append(ledger_entry(item.user_id, item.value, "admin_delta"))
+                balances[item.user_id] += item.value
+            item_points[index] = balances[item.user_id]
+
+        # Подряд идущие операции одного типа выполняются одним executemany, порядок сохраняется
+        connection = session.connection()
+        run_mode, run_params = None, []
+        for item in chunk:
+            if item.user_id not in found:
+                continue
+            if item.mode != run_mode and run_params:
+                connection.execute(set_stmt if run_mode == "set" else delta_stmt, run_params)
+                run_params = []
+            run_mode = item.mode
+            run_params.append({"uid": item.user_id, "value": item.value})
+        if run_params:
+            connection.execute(set_stmt if run_mode == "set" else delta_stmt, run_params)
+        record_ledger(session, entries)
+        session.commit()
+
+        for index, item in enumerate(chunk, start):
+            if item.user_id in found:
+                results.append({"index": index, "user_id": item.user_id, "status": "updated",
+                                "points": item_points[index]})
+            else:
+                results.append({"index": index, "user_id": item.user_id, "status": "error",
+                                "detail": "User not found"})
 
     return {
-        "message": "Bet completed successfully",
-        "winners_count": winners_count,
-        "total_winnings": total_winnings
+        "updated": sum(1 for result in results if result["status"] == "updated"),
+        "failed": sum(1 for result in results if result["status"] == "error"),
+        "results": results
     }
 
 
-@app.get("/admin/all_bets", response_model=List[dict], dependencies=[Depends(verify_admin_token)])
-async def get_all_bets(session: Session = Depends(get_session)):
+@app.get("/admin/all_bets", response_model=List[AdminBetOut], dependencies=[Depends(verify_admin_token)])
+async def get_all_bets(session: Session = Depends(read_session("admin_all_bets"))):
     bets = session.exec(select(Bet)).all()
     result = []
 
     for bet in bets:
-        bet_dict = {
-            "id": bet.id,
-            "title": bet.title,
-            "description": bet.description,
-            "options": bet.get_options(),
-            "is_active": bet.is_active,
-            "created_at": bet.created_at,
-            "end_time": bet.end_time,
-            "winning_option": bet.winning_option
-        }
-        result.append(bet_dict)
+        result.append(AdminBetOut(
+            id=bet.id,
+            title=bet.title,
+            description=bet.description,
+            options=bet.get_options(),
+            is_active=bet.is_active,
+            created_at=bet.created_at,
+            end_time=bet.end_time,
+            winning_option=bet.winning_option
+        ))
 
     return result
 
 
-@app.get("/admin/users", response_model=List[dict], dependencies=[Depends(verify_admin_token)])
-async def get_all_users(session: Session = Depends(get_session)):
+@app.post("/admin/archive_bets", response_model=dict, dependencies=[Depends(verify_admin_token)])
+async def archive_bets(
+        older_than_days: int = ARCHIVE_AFTER_DAYS,
+        session: Session = Depends(get_session)
+):
+    """Перенести старые рассчитанные ставки в архив"""
+    return archive_settled_bets(session, older_than_days=older_than_days)
+
+
+@app.get("/admin/users/{user_id}/ledger", response_model=dict, dependencies=[Depends(verify_admin_token)])
+async def get_user_ledger(
+        user_id: int,
+        limit: int = 100,
+        session: Session = Depends(get_session)
+):
+    """Последние записи журнала и сверка материализованного баланса с журналом"""
+    user = session.get(User, user_id)
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+
+    entries = session.exec(
+        select(PointsLedger).where(PointsLedger.user_id == user_id)
+        .order_by(PointsLedger.id.desc()).limit(limit)
+    ).all()
+    reconstructed = reconstruct_balance(session, user_id)
+
+    return {
+        "user_id": user_id,
+        "points": user.points,
+        "reconstructed_points": reconstructed,
+        "consistent": abs(user.points - reconstructed) < 1e-6,
+        "entries": [
+            {
+                "id": entry.id,
+                "delta": entry.delta,
+                "reason": entry.reason,
+                "bet_id": entry.bet_id,
+                "created_at": entry.created_at
+            }
+            for entry in entries
+        ]
+    }
+
+
+@app.post("/admin/snapshot_balances", response_model=dict, dependencies=[Depends(verify_admin_token)])
+async def create_balance_snapshots(session: Session = Depends(get_session)):
+    return {"snapshots_created": snapshot_balances(session)}
+
+
+@app.post("/admin/rollback_settlement/{bet_id}", response_model=dict, dependencies=[Depends(verify_admin_token)])
+async def rollback_bet_settlement(
+        bet_id: int,
+        session: Session = Depends(get_session)
+):
+    """Откатить ошибочный расчёт события, после чего его можно рассчитать заново"""
+    result = rollback_settlement(session, bet_id)
+    if result is None:
+        raise HTTPException(status_code=404, detail="Settled bet not found")
+
+    return {"message": "Settlement rolled back", **result}
+
+
+@app.get("/admin/users", response_model=List[AdminUserOut], dependencies=[Depends(verify_admin_token)])
+async def get_all_users(session: Session = Depends(read_session("admin_users"))):
     users = session.exec(select(User)).all()
     result = []
 
     for user in users:
-        user_dict = {
-            "id": user.id,
-            "username": user.username,
-            "email": user.email,
-            "discord_id": user.discord_id,
-            "points": user.points,
-            "is_active": user.is_active,
-            "is_verified": user.is_verified,
-            "created_at": user.created_at
-        }
-        result.append(user_dict)
+        result.append(AdminUserOut(
+            id=user.id,
+            username=user.username,
+            email=user.email,
+            discord_id=user.discord_id,
+            points=user.points,
+            is_active=user.is_active,
+            is_verified=user.is_verified,
+            created_at=user.created_at
+        ))
 
     return result
 
@@ -702,6 +2296,7 @@ async def update_user_points(
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
 
+    record_ledger(session, [ledger_entry(user.id, points - user.points, "admin_set")])
     user.points = points
     session.add(user)
     session.commit()
@@ -710,4 +2305,9 @@ async def update_user_points(
 
 
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    if WEB_CONCURRENCY > 1:
+        # Таблицы создаём один раз до запуска воркеров, чтобы избежать гонки
+        create_db_and_tables()
+        uvicorn.run("main:app", host="0.0.0.0", port=8000, workers=WEB_CONCURRENCY)
+    else:
+        uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
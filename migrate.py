@@ -0,0 +1,62 @@
+"""Применение SQL-миграций из каталога migrations/
+
+Файл вида 002_name.sqlite.sql применяется только на указанном диалекте.
+Запуск вручную: python migrate.py (использует DATABASE_URL из main.py)
+"""
+from pathlib import Path
+
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+
+MIGRATIONS_DIR = Path(__file__).resolve().parent / "migrations"
+
+
+def _statements(sql: str):
+    for statement in sql.split(";"):
+        lines = [line for line in statement.splitlines() if not line.strip().startswith("--")]
+        statement = "\n".join(lines).strip()
+        if statement:
+            yield statement
+
+
+def _dialect(path: Path):
+    suffixes = path.suffixes
+    return suffixes[-2][1:] if len(suffixes) > 1 else None
+
+
+def run_migrations(engine: Engine, migrations_dir: Path = MIGRATIONS_DIR) -> list:
+    """Применить ещё не выполненные миграции, вернуть их имена"""
+    applied_now = []
+    with engine.begin() as conn:
+        conn.execute(text(
+            "CREATE TABLE IF NOT EXISTS schema_migrations ("
+            "name VARCHAR(255) PRIMARY KEY, "
+            "applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)"
+        ))
+        applied = {row[0] for row in conn.execute(text("SELECT name FROM schema_migrations"))}
+
+    for path in sorted(migrations_dir.glob("*.sql")):
+        if path.name in applied:
+            continue
+        dialect = _dialect(path)
+        if dialect and dialect != engine.dialect.name:
+            continue
+        with engine.begin() as conn:
+            if engine.dialect.name == "sqlite":
+                # pysqlite сам открывает транзакцию только перед DML, а DDL до неё
+                # фиксирует сразу; явный BEGIN делает миграцию атомарной
+                conn.exec_driver_sql("BEGIN")
+            for statement in _statements(path.read_text(encoding="utf-8")):
+                conn.execute(text(statement))
+            conn.execute(text("INSERT INTO schema_migrations (name) VALUES (:name)"), {"name": path.name})
+        applied_now.append(path.name)
+    return applied_now
+
+
+if __name__ == "__main__":
+    # Миграции опираются на таблицы моделей (архив, журнал баллов), поэтому сначала
+    # создаём недостающие таблицы, как create_db_and_tables() при старте приложения
+    from main import SQLModel, engine
+    SQLModel.metadata.create_all(engine)
+    for name in run_migrations(engine):
+        print(f"Применена миграция {name}")
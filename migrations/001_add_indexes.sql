@@ -0,0 +1,5 @@
+-- Индексы для горячих запросов: лидерборд, поиск по Discord ID, ставки пользователя и события
+CREATE INDEX IF NOT EXISTS ix_user_points ON "user" (points);
+CREATE INDEX IF NOT EXISTS ix_user_discord_id ON "user" (discord_id);
+CREATE INDEX IF NOT EXISTS ix_userbet_bet_id ON userbet (bet_id);
+CREATE INDEX IF NOT EXISTS ix_userbet_user_id ON userbet (user_id);
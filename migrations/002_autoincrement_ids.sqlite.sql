@@ -0,0 +1,45 @@
+-- SQLite без AUTOINCREMENT отдаёт максимальный удалённый id заново: после архивации
+-- новое событие получало id архивного, ломая вставку в архив и ссылки bet_id в журнале.
+-- Пересоздаём bet и userbet с AUTOINCREMENT и продвигаем счётчики за id из архива.
+-- Остатки прерванного запуска старой версии миграции удаляем.
+DROP TABLE IF EXISTS bet_new;
+DROP TABLE IF EXISTS userbet_new;
+
+CREATE TABLE bet_new (
+    id INTEGER NOT NULL PRIMARY KEY AUTOINCREMENT,
+    title VARCHAR NOT NULL,
+    description VARCHAR,
+    options VARCHAR NOT NULL,
+    is_active BOOLEAN NOT NULL,
+    created_at DATETIME NOT NULL,
+    end_time DATETIME,
+    winning_option VARCHAR
+);
+INSERT INTO bet_new (id, title, description, options, is_active, created_at, end_time, winning_option)
+SELECT id, title, description, options, is_active, created_at, end_time, winning_option FROM bet;
+DROP TABLE bet;
+ALTER TABLE bet_new RENAME TO bet;
+
+CREATE TABLE userbet_new (
+    id INTEGER NOT NULL PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER NOT NULL REFERENCES "user" (id),
+    bet_id INTEGER NOT NULL REFERENCES bet (id),
+    selected_option VARCHAR NOT NULL,
+    amount FLOAT NOT NULL,
+    potential_win FLOAT NOT NULL,
+    is_won BOOLEAN,
+    created_at DATETIME NOT NULL
+);
+INSERT INTO userbet_new (id, user_id, bet_id, selected_option, amount, potential_win, is_won, created_at)
+SELECT id, user_id, bet_id, selected_option, amount, potential_win, is_won, created_at FROM userbet;
+DROP TABLE userbet;
+ALTER TABLE userbet_new RENAME TO userbet;
+CREATE INDEX IF NOT EXISTS ix_userbet_bet_id ON userbet (bet_id);
+CREATE INDEX IF NOT EXISTS ix_userbet_user_id ON userbet (user_id);
+
+INSERT INTO sqlite_sequence (name, seq)
+SELECT 'bet', 0 WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = 'bet');
+UPDATE sqlite_sequence SET seq = max(seq, (SELECT coalesce(max(id), 0) FROM archivedbet)) WHERE name = 'bet';
+INSERT INTO sqlite_sequence (name, seq)
+SELECT 'userbet', 0 WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = 'userbet');
+UPDATE sqlite_sequence SET seq = max(seq, (SELECT coalesce(max(id), 0) FROM archiveduserbet)) WHERE name = 'userbet';
@@ -0,0 +1,10 @@
+-- Признак выплаченного бонуса за Discord — запись discord_bonus в журнале баллов.
+-- Аккаунты, верифицированные до появления журнала, бонус уже получили: ставим им
+-- нулевую запись, чтобы перепривязка не начислила его повторно.
+INSERT INTO pointsledger (user_id, delta, reason, created_at)
+SELECT u.id, 0, 'discord_bonus', CURRENT_TIMESTAMP
+FROM "user" u
+WHERE u.is_verified = TRUE
+  AND NOT EXISTS (
+      SELECT 1 FROM pointsledger l WHERE l.user_id = u.id AND l.reason = 'discord_bonus'
+  );
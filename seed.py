@@ -0,0 +1,241 @@
+"""Генерация синтетических данных для нагрузочного тестирования
+
+Пишет пользователей, события и ставки напрямую в БД пачками, минуя API и bcrypt
+(у всех пользователей один заранее посчитанный хеш пароля). Завершённые события
+получают is_won, но выплаты не начисляются — откатывать их расчёт нельзя.
+
+Пример: python seed.py --users 100000 --bets 20000 --wagers 10000000
+        python seed.py --users 0 --bets 0 --wagers 0 --keys 1000000 --keys-db keys_database.db
+"""
+import argparse
+import json
+import random
+import sqlite3
+import string
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, select, text
+
+from main import (
+    ArchivedBet, ArchivedUserBet, Bet, User, UserBet, create_db_and_tables, engine, get_password_hash
+)
+
+OPTION_NAMES = ["Команда A", "Команда B", "Ничья", "Тотал больше", "Тотал меньше"]
+
+
+def sequence_name(conn, table):
+    name = engine.dialect.identifier_preparer.quote(table.name)
+    return conn.execute(text("SELECT pg_get_serial_sequence(:name, 'id')"), {"name": name}).scalar()
+
+
+def last_issued_id(conn, table) -> int:
+    """Последний выданный id по счётчику автоинкремента (sqlite_sequence / последовательность Postgres)"""
+    if engine.dialect.name == "sqlite":
+        row = conn.execute(
+            text("SELECT seq FROM sqlite_sequence WHERE name = :name"), {"name": table.name}
+        ).first()
+        return row[0] if row else 0
+    if engine.dialect.name == "postgresql":
+        sequence = sequence_name(conn, table)
+        return conn.execute(text(f"SELECT last_value FROM {sequence}")).scalar() if sequence else 0
+    return 0
+
+
+def next_id(table, archive=None) -> int:
+    """Первый id, который не выдавался: выше горячей таблицы, архива и счётчика автоинкремента"""
+    with engine.connect() as conn:
+        used = [conn.execute(select(func.coalesce(func.max(table.c.id), 0))).scalar() or 0]
+        if archive is not None:
+            used.append(conn.execute(select(func.coalesce(func.max(archive.c.id), 0))).scalar() or 0)
+        used.append(last_issued_id(conn, table))
+    return max(used) + 1
+
+
+def insert_batches(table, rows, batch_size: int) -> int:
+    """Вставить строки из генератора пачками, по транзакции на пачку"""
+    total = 0
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            with engine.begin() as conn:
+                conn.execute(table.insert(), batch)
+            total += len(batch)
+            batch = []
+    if batch:
+        with engine.begin() as conn:
+            conn.execute(table.insert(), batch)
+        total += len(batch)
+    return total
+
+
+def sync_sequence(table):
+    """Postgres: продвинуть последовательность id после вставки с явными id (только вперёд)"""
+    if engine.dialect.name != "postgresql":
+        return
+    name = engine.dialect.identifier_preparer.quote(table.name)
+    with engine.begin() as conn:
+        sequence = sequence_name(conn, table)
+        if sequence:
+            conn.execute(text(
+                f"SELECT setval(:sequence, GREATEST((SELECT COALESCE(MAX(id), 1) FROM {name}), "
+                f"(SELECT last_value FROM {sequence})))"
+            ), {"sequence": sequence})
+
+
+def random_time(rng: random.Random, days: int) -> datetime:
+    return datetime.now() - timedelta(seconds=rng.randint(0, days * 86400))
+
+
+def generate_users(rng: random.Random, first_id: int, count: int, password_hash: str, days: int):
+    for user_id in range(first_id, first_id + count):
+        verified = rng.random() < 0.8
+        yield {
+            "id": user_id,
+            "username": f"seed_user_{user_id}",
+            "email": f"seed_user_{user_id}@example.com",
+            "discord_id": str(10 ** 17 + user_id) if verified else None,
+            "hashed_password": password_hash,
+            # Баланс с длинным хвостом: большинство около стартовых 1000, редкие крупные выигрыши
+            "points": round(rng.lognormvariate(6.9, 0.8), 2),
+            "is_active": rng.random() < 0.98,
+            "is_verified": verified,
+            "created_at": random_time(rng, days),
+        }
+
+
+def generate_bets(rng: random.Random, first_id: int, count: int, active_share: float, days: int, catalog: dict):
+    for bet_id in range(first_id, first_id + count):
+        names = rng.sample(OPTION_NAMES, rng.randint(2, 4))
+        options = [{"name": name, "coefficient": round(rng.uniform(1.2, 5.0), 2)} for name in names]
+        is_active = rng.random() < active_share
+        created_at = random_time(rng, days)
+        end_time = created_at + timedelta(hours=rng.randint(1, 72))
+        if is_active:
+            end_time = datetime.now() + timedelta(hours=rng.randint(1, 72))
+        winning_option = None if is_active else rng.choice(names)
+        catalog[bet_id] = (options, winning_option, created_at)
+        yield {
+            "id": bet_id,
+            "title": f"Событие #{bet_id}",
+            "description": None,
+            "options": json.dumps(options),
+            "is_active": is_active,
+            "created_at": created_at,
+            "end_time": end_time,
+            "winning_option": winning_option,
+        }
+
+
+def generate_wagers(rng: random.Random, first_id: int, count: int, user_ids: list, catalog: dict):
+    bet_ids = list(catalog)
+    user_count = len(user_ids)
+    for wager_id in range(first_id, first_id + count):
+        # Активность пользователей по Парето: небольшая доля делает большую часть ставок
+        user_index = min(int(rng.paretovariate(1.16)) - 1, user_count - 1)
+        user_id = user_ids[(user_index * 2654435761) % user_count]
+        bet_id = rng.choice(bet_ids)
+        options, winning_option, bet_created_at = catalog[bet_id]
+        option = rng.choice(options)
+        amount = round(min(rng.lognormvariate(3.5, 1.0), 5000), 2)
+        yield {
+            "id": wager_id,
+            "user_id": user_id,
+            "bet_id": bet_id,
+            "selected_option": option["name"],
+            "amount": amount,
+            "potential_win": round(amount * option["coefficient"], 2),
+            "is_won": None if winning_option is None else option["name"] == winning_option,
+            "created_at": bet_created_at + timedelta(seconds=rng.randint(0, 3600)),
+        }
+
+
+def seed_keys(db_path: str, count: int, batch_size: int, rng: random.Random) -> int:
+    """Дополнить пул ключей бота до count штук (та же схема, что в KeyBot.init_database)"""
+    conn = sqlite3.connect(db_path)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS keys (
+            key TEXT PRIMARY KEY,
+            user_id INTEGER,
+            used BOOLEAN DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            used_at TIMESTAMP
+        )
+    ''')
+    existing = conn.execute("SELECT COUNT(*) FROM keys").fetchone()[0]
+    alphabet = string.ascii_letters + string.digits
+
+    while existing < count:
+        size = min(batch_size, count - existing)
+        batch = [(''.join(rng.choices(alphabet, k=16)),) for _ in range(size)]
+        conn.executemany("INSERT OR IGNORE INTO keys (key) VALUES (?)", batch)
+        conn.commit()
+        existing = conn.execute("SELECT COUNT(*) FROM keys").fetchone()[0]
+
+    conn.close()
+    return existing
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Синтетические данные для нагрузочных тестов")
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--bets", type=int, default=1000)
+    parser.add_argument("--wagers", type=int, default=100000)
+    parser.add_argument("--active-share", type=float, default=0.05, help="доля активных событий")
+    parser.add_argument("--days", type=int, default=180, help="глубина истории в днях")
+    parser.add_argument("--batch-size", type=int, default=10000)
+    parser.add_argument("--password", default="password", help="общий пароль всех сгенерированных пользователей")
+    parser.add_argument("--keys", type=int, default=0, help="довести пул ключей бота до этого размера")
+    parser.add_argument("--keys-db", default="keys_database.db")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    create_db_and_tables()
+
+    user_table, bet_table, wager_table = User.__table__, Bet.__table__, UserBet.__table__
+    archived_bet_table, archived_wager_table = ArchivedBet.__table__, ArchivedUserBet.__table__
+    started = time.monotonic()
+
+    if args.users:
+        first_user = next_id(user_table)
+        password_hash = get_password_hash(args.password)
+        inserted = insert_batches(
+            user_table, generate_users(rng, first_user, args.users, password_hash, args.days), args.batch_size
+        )
+        sync_sequence(user_table)
+        print(f"Пользователи: {inserted} ({time.monotonic() - started:.1f} с)")
+
+    catalog = {}
+    if args.bets:
+        first_bet = next_id(bet_table, archived_bet_table)
+        inserted = insert_batches(
+            bet_table, generate_bets(rng, first_bet, args.bets, args.active_share, args.days, catalog),
+            args.batch_size
+        )
+        sync_sequence(bet_table)
+        print(f"События: {inserted} ({time.monotonic() - started:.1f} с)")
+
+    if args.wagers:
+        if not catalog:
+            parser.error("для генерации ставок нужны события в этом же запуске (--bets > 0)")
+        with engine.connect() as conn:
+            user_ids = conn.execute(select(user_table.c.id).order_by(user_table.c.id)).scalars().all()
+        if not user_ids:
+            parser.error("в базе нет пользователей")
+        first_wager = next_id(wager_table, archived_wager_table)
+        inserted = insert_batches(
+            wager_table, generate_wagers(rng, first_wager, args.wagers, user_ids, catalog), args.batch_size
+        )
+        sync_sequence(wager_table)
+        print(f"Ставки: {inserted} ({time.monotonic() - started:.1f} с)")
+
+    if args.keys:
+        total = seed_keys(args.keys_db, args.keys, args.batch_size, rng)
+        print(f"Ключи бота: {total} ({time.monotonic() - started:.1f} с)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""Шина событий в памяти (EVENT_BUS_URL=memory://): consumer group и путь запрос -> результат
+
+Запуск: python -m pytest -q test_event_bus.py
+"""
+import asyncio
+import threading
+
+import pytest
+
+import event_bus
+from event_bus import VERIFICATION_REQUESTS, VERIFICATION_RESULTS, create_bus
+
+
+@pytest.fixture
+def memory_bus(monkeypatch):
+    monkeypatch.setattr(event_bus, "_memory_bus", None)
+    return create_bus("memory://")
+
+
+def test_consumer_group_redelivers_only_unacked(memory_bus):
+    message_id = memory_bus.publish(VERIFICATION_REQUESTS, {"key": "a"})
+
+    assert memory_bus.read_group(VERIFICATION_REQUESTS, "bot", "c1", block_ms=0) == [(message_id, {"key": "a"})]
+    # Выданное одному потребителю другой не получает, пока оно не зависло
+    assert memory_bus.read_group(VERIFICATION_REQUESTS, "bot", "c2", block_ms=0) == []
+    # Зависшее без ack перебирает другой потребитель
+    assert memory_bus.read_group(
+        VERIFICATION_REQUESTS, "bot", "c2", block_ms=0, claim_idle_ms=0
+    ) == [(message_id, {"key": "a"})]
+
+    memory_bus.ack(VERIFICATION_REQUESTS, "bot", message_id)
+    assert memory_bus.read_group(VERIFICATION_REQUESTS, "bot", "c3", block_ms=0, claim_idle_ms=0) == []
+
+
+def fake_bot(bus, stop):
+    """Потребитель как run_verification_consumer в theroflint.py, без Discord"""
+    while not stop.is_set():
+        for message_id, fields in bus.read_group(VERIFICATION_REQUESTS, "bot", "test", block_ms=50):
+            status = 200 if "secret" not in fields and fields["key"] == "good" else 404
+            bus.publish(VERIFICATION_RESULTS, {
+                "request_id": fields["request_id"], "status": status, "body": {"key": fields["key"]}
+            })
+            bus.ack(VERIFICATION_REQUESTS, "bot", message_id)
+
+
+def test_verification_request_wakes_matching_waiter(memory_bus, monkeypatch):
+    main = pytest.importorskip("main")
+    monkeypatch.setattr(main, "EVENT_BUS_URL", "memory://")
+
+    stop = threading.Event()
+    bot = threading.Thread(target=fake_bot, args=(memory_bus, stop), daemon=True)
+    bot.start()
+
+    async def scenario():
+        client = main.VerificationBusClient()
+        client.start()
+        try:
+            return await asyncio.gather(client.request({"key": "good"}), client.request({"key": "bad"}))
+        finally:
+            await client.stop()
+
+    try:
+        good, bad = asyncio.run(scenario())
+    finally:
+        stop.set()
+        bot.join()
+
+    assert good == (200, {"key": "good"})
+    assert bad == (404, {"key": "bad"})
+    assert memory_bus._groups[(VERIFICATION_REQUESTS, "bot")]["pending"] == {}
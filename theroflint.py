@@ -8,9 +8,24 @@ import asyncio
 from flask import Flask, request, jsonify
 from flask_cors import CORS
 import threading
+import queue
+import atexit
+from datetime import datetime, timedelta
 import logging
 import httpx
 import os
+from event_bus import VERIFICATION_REQUESTS, VERIFICATION_RESULTS, create_bus
+import json
+import time
+import hashlib
+import hmac
+import socket
+from collections import OrderedDict
+
+try:
+    import redis
+except ImportError:
+    redis = None
 
 # Настройки
 GUILD_ID = int(os.getenv('GUILD_ID', '680473306440269852'))
@@ -21,25 +36,96 @@ WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET', 'ABOBAROFLINT228ZXC')
 # URL основного API
 MAIN_API_URL = os.getenv('MAIN_API_URL', 'http://localhost:8000')
 
+# Режим ключей: pool — заранее сгенерированный пул, hmac — ключ вычисляется из Discord ID
+KEY_MODE = os.getenv('KEY_MODE', 'pool')
+# Секреты для hmac-режима через запятую: первым идёт текущий, остальные принимаются до окончания ротации
+KEY_SECRETS = [secret for secret in os.getenv('KEY_SECRETS', '').split(',') if secret]
+KEY_LENGTH = 16
+KEY_ALPHABET = string.ascii_letters + string.digits
+
+if KEY_MODE not in ('pool', 'hmac'):
+    raise ValueError(f"Неизвестный KEY_MODE: {KEY_MODE}")
+if KEY_MODE == 'hmac' and not KEY_SECRETS:
+    raise ValueError("Для KEY_MODE=hmac нужно задать KEY_SECRETS")
+
+# Экономный режим: без привилегированных intents и кеша участников, участники запрашиваются по требованию
+BOT_LEAN_MODE = os.getenv('BOT_LEAN_MODE', 'false').lower() == 'true'
+BOT_AUTO_SHARD = os.getenv('BOT_AUTO_SHARD', 'false').lower() == 'true'
+BOT_SHARD_COUNT = int(os.getenv('BOT_SHARD_COUNT', '0')) or None  # None — число шардов выбирает Discord
+MEMBER_CACHE_SIZE = int(os.getenv('MEMBER_CACHE_SIZE', '1024'))
+
+# Журнал верификаций: запись пачками в фоне, старые строки сворачиваются в дневную статистику
+LOG_BATCH_SIZE = int(os.getenv('LOG_BATCH_SIZE', '100'))
+LOG_FLUSH_INTERVAL = float(os.getenv('LOG_FLUSH_INTERVAL', '1.0'))
+LOG_RETENTION_DAYS = int(os.getenv('LOG_RETENTION_DAYS', '90'))
+LOG_COMPACT_INTERVAL = int(os.getenv('LOG_COMPACT_INTERVAL', '3600'))
+
+# Idempotency-Key для webhook: Redis, если задан REDIS_URL, иначе LRU в памяти
+REDIS_URL = os.getenv('REDIS_URL', '')
+IDEMPOTENCY_TTL = int(os.getenv('IDEMPOTENCY_TTL', '86400'))
+IDEMPOTENCY_PENDING_TTL = int(os.getenv('IDEMPOTENCY_PENDING_TTL', '30'))
+IDEMPOTENCY_LOCAL_MAX = int(os.getenv('IDEMPOTENCY_LOCAL_MAX', '10000'))
+
+# Транспорт верификации: http — только webhook, bus — дополнительно читаем запросы из Redis Streams
+VERIFICATION_TRANSPORT = os.getenv('VERIFICATION_TRANSPORT', 'http')
+EVENT_BUS_URL = os.getenv('EVENT_BUS_URL', REDIS_URL or 'redis://localhost:6379')
+
 # Настройка логирования
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
 
-class KeyBot(commands.Bot):
+BotBase = commands.AutoShardedBot if BOT_AUTO_SHARD else commands.Bot
+
+
+class KeyBot(BotBase):
     def __init__(self):
         intents = discord.Intents.default()
-        intents.message_content = True
-        intents.members = True
-        super().__init__(command_prefix='!', intents=intents)
+        options = {}
+        if BOT_LEAN_MODE:
+            # Бот работает только через slash-команды: содержимое сообщений и список участников не нужны
+            options['member_cache_flags'] = discord.MemberCacheFlags.none()
+            options['chunk_guilds_at_startup'] = False
+        else:
+            intents.message_content = True
+            intents.members = True
+        if BOT_AUTO_SHARD:
+            options['shard_count'] = BOT_SHARD_COUNT
+        super().__init__(command_prefix='!', intents=intents, **options)
         self.db_path = 'keys_database.db'
+        self.member_cache = OrderedDict()  # (guild_id, user_id) -> Member
         self.init_database()
 
+    async def get_or_fetch_member(self, guild, user_id):
+        """Участник из кеша гильдии, затем из небольшого LRU, затем через REST API"""
+        member = guild.get_member(user_id)
+        if member:
+            return member
+
+        cache_key = (guild.id, user_id)
+        member = self.member_cache.get(cache_key)
+        if member:
+            self.member_cache.move_to_end(cache_key)
+            return member
+
+        try:
+            member = await guild.fetch_member(user_id)
+        except discord.NotFound:
+            return None
+
+        self.member_cache[cache_key] = member
+        while len(self.member_cache) > MEMBER_CACHE_SIZE:
+            self.member_cache.popitem(last=False)
+        return member
+
     def init_database(self):
         """Инициализация базы данных"""
         conn = sqlite3.connect(self.db_path)
         c = conn.cursor()
 
+        # WAL, чтобы фоновая запись журнала не блокировала webhook и команды
+        c.execute("PRAGMA journal_mode=WAL")
+
         c.execute('''
             CREATE TABLE IF NOT EXISTS keys (
                 key TEXT PRIMARY KEY,
@@ -50,6 +136,8 @@ class KeyBot(commands.Bot):
             )
         ''')
 
+        c.execute("CREATE INDEX IF NOT EXISTS idx_keys_user_id ON keys (user_id)")
+
         c.execute('''
             CREATE TABLE IF NOT EXISTS verification_logs (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -60,6 +148,17 @@ class KeyBot(commands.Bot):
             )
         ''')
 
+        c.execute("CREATE INDEX IF NOT EXISTS idx_verification_logs_timestamp ON verification_logs (timestamp)")
+
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS verification_log_daily (
+                day TEXT,
+                role_given TEXT,
+                count INTEGER DEFAULT 0,
+                PRIMARY KEY (day, role_given)
+            )
+        ''')
+
         conn.commit()
         conn.close()
 
@@ -103,10 +202,190 @@ class KeyBot(commands.Bot):
 bot = KeyBot()
 
 
+class VerificationLogWriter:
+    """Буферизованная запись verification_logs: пачка уходит по размеру или по таймеру"""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.queue = queue.Queue()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def log(self, user_id, key, role_given):
+        timestamp = datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')  # как CURRENT_TIMESTAMP
+        self.queue.put((user_id, key, role_given, timestamp))
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='verification-log-writer', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """Остановить поток, дописав всё, что осталось в очереди"""
+        if self._thread is not None:
+            self._stop_event.set()
+            self._thread.join(timeout=10)
+            self._thread = None
+
+    def _run(self):
+        conn = sqlite3.connect(self.db_path)
+        buffer = []
+        last_flush = time.monotonic()
+        last_compact = time.monotonic() - LOG_COMPACT_INTERVAL  # первое сжатие сразу при старте
+
+        while not self._stop_event.is_set() or not self.queue.empty():
+            timeout = max(LOG_FLUSH_INTERVAL - (time.monotonic() - last_flush), 0.05)
+            try:
+                buffer.append(self.queue.get(timeout=timeout))
+            except queue.Empty:
+                pass
+
+            if len(buffer) >= LOG_BATCH_SIZE or (buffer and time.monotonic() - last_flush >= LOG_FLUSH_INTERVAL):
+                self._flush(conn, buffer)
+                buffer = []
+                last_flush = time.monotonic()
+
+            if time.monotonic() - last_compact >= LOG_COMPACT_INTERVAL:
+                self._compact(conn)
+                last_compact = time.monotonic()
+
+        if buffer:
+            self._flush(conn, buffer)
+        conn.close()
+
+    @staticmethod
+    def _flush(conn, rows):
+        try:
+            conn.executemany(
+                "INSERT INTO verification_logs (user_id, key, role_given, timestamp) VALUES (?, ?, ?, ?)",
+                rows
+            )
+            conn.commit()
+        except sqlite3.Error as e:
+            conn.rollback()
+            logger.error(f"Не удалось записать {len(rows)} строк журнала верификаций: {e}")
+
+    @staticmethod
+    def _compact(conn):
+        """Свернуть строки старше LOG_RETENTION_DAYS в дневные счётчики и удалить их"""
+        cutoff = (datetime.utcnow() - timedelta(days=LOG_RETENTION_DAYS)).strftime('%Y-%m-%d %H:%M:%S')
+        try:
+            conn.execute('''
+                INSERT INTO verification_log_daily (day, role_given, count)
+                SELECT date(timestamp), role_given, COUNT(*) FROM verification_logs
+                WHERE timestamp < ?
+                GROUP BY date(timestamp), role_given
+                ON CONFLICT (day, role_given) DO UPDATE SET count = count + excluded.count
+            ''', (cutoff,))
+            deleted = conn.execute("DELETE FROM verification_logs WHERE timestamp < ?", (cutoff,)).rowcount
+            conn.commit()
+            if deleted:
+                logger.info(f"Журнал верификаций: свёрнуто {deleted} старых строк")
+        except sqlite3.Error as e:
+            conn.rollback()
+            logger.error(f"Ошибка сжатия журнала верификаций: {e}")
+
+
+log_writer = VerificationLogWriter(bot.db_path)
+
+
+def derive_key(user_id, secret):
+    """Ключ верификации = HMAC-SHA256(secret, Discord ID) в алфавите пула"""
+    digest = hmac.new(secret.encode(), f"verify:{user_id}".encode(), hashlib.sha256).digest()
+    number = int.from_bytes(digest, 'big')
+    chars = []
+    for _ in range(KEY_LENGTH):
+        number, index = divmod(number, len(KEY_ALPHABET))
+        chars.append(KEY_ALPHABET[index])
+    return ''.join(chars)
+
+
+def is_derived_key_valid(user_id, key):
+    """Проверить ключ по всем активным секретам (поддержка ротации)"""
+    return any(hmac.compare_digest(derive_key(user_id, secret), key) for secret in KEY_SECRETS)
+
+
+def key_instructions(key):
+    return (
+        f"🔑 **Ваш уникальный ключ:** `{key}`\n\n"
+        f"📝 **Инструкция:**\n"
+        f"1. Скопируйте этот ключ\n"
+        f"2. Перейдите на сайт {MAIN_API_URL} для верификации\n"
+        f"3. Зарегистрируйтесь или войдите в свой аккаунт\n"
+        f"4. Привяжите Discord аккаунт, используя ключ\n"
+        f"5. После подтверждения вы автоматически получите роль на сервере\n\n"
+        f"⚠️ **Важно:** Этот ключ уникален и может быть использован только один раз!"
+    )
+
+
+class IdempotencyCache:
+    """Сохранённые ответы webhook по Idempotency-Key"""
+
+    def __init__(self):
+        self._local = OrderedDict()  # key -> (expires_at, record)
+        self._lock = threading.Lock()
+        self._redis = None
+        if redis is not None and REDIS_URL:
+            self._redis = redis.from_url(REDIS_URL, socket_connect_timeout=0.5, socket_timeout=0.5)
+
+    def begin(self, key, fingerprint):
+        """None — запрос новый и ключ занят; иначе существующая запись"""
+        pending = {'state': 'pending', 'fingerprint': fingerprint}
+        if self._redis is not None:
+            try:
+                if self._redis.set(key, json.dumps(pending), nx=True, ex=IDEMPOTENCY_PENDING_TTL):
+                    return None
+                raw = self._redis.get(key)
+                return json.loads(raw) if raw else None
+            except redis.RedisError as e:
+                logger.warning(f"Redis недоступен, используется локальный кеш: {e}")
+
+        with self._lock:
+            entry = self._local.get(key)
+            if entry is not None and entry[0] >= time.monotonic():
+                self._local.move_to_end(key)
+                return entry[1]
+            self._store_local(key, pending, IDEMPOTENCY_PENDING_TTL)
+            return None
+
+    def complete(self, key, fingerprint, body, status_code):
+        record = {'state': 'done', 'fingerprint': fingerprint, 'body': body, 'status': status_code}
+        if self._redis is not None:
+            try:
+                self._redis.set(key, json.dumps(record), ex=IDEMPOTENCY_TTL)
+                with self._lock:
+                    self._local.pop(key, None)
+                return
+            except redis.RedisError as e:
+                logger.warning(f"Redis недоступен, используется локальный кеш: {e}")
+
+        with self._lock:
+            self._store_local(key, record, IDEMPOTENCY_TTL)
+
+    def release(self, key):
+        if self._redis is not None:
+            try:
+                self._redis.delete(key)
+            except redis.RedisError:
+                pass
+        with self._lock:
+            self._local.pop(key, None)
+
+    def _store_local(self, key, record, ttl):
+        self._local[key] = (time.monotonic() + ttl, record)
+        self._local.move_to_end(key)
+        while len(self._local) > IDEMPOTENCY_LOCAL_MAX:
+            self._local.popitem(last=False)
+
+
+idempotency_cache = IdempotencyCache()
+
+
 @bot.event
 async def on_ready():
     logger.info(f'Бот {bot.user} запущен!')
-    bot.generate_keys()
+    if KEY_MODE == 'pool':
+        bot.generate_keys()
 
     try:
         synced = await bot.tree.sync()
@@ -120,6 +399,12 @@ async def get_key(interaction: discord.Interaction):
     """Команда для получения ключа"""
     user_id = interaction.user.id
 
+    if KEY_MODE == 'hmac':
+        # Ключ не хранится: он вычисляется заново при каждом запросе и проверке
+        await interaction.response.send_message(key_instructions(derive_key(user_id, KEY_SECRETS[0])), ephemeral=True)
+        logger.info(f"Пользователь {interaction.user.name} (ID: {user_id}) получил hmac-ключ")
+        return
+
     conn = sqlite3.connect(bot.db_path)
     c = conn.cursor()
 
@@ -152,17 +437,7 @@ async def get_key(interaction: discord.Interaction):
     conn.commit()
     conn.close()
 
-    await interaction.response.send_message(
-        f"🔑 **Ваш уникальный ключ:** `{key}`\n\n"
-        f"📝 **Инструкция:**\n"
-        f"1. Скопируйте этот ключ\n"
-        f"2. Перейдите на сайт {MAIN_API_URL} для верификации\n"
-        f"3. Зарегистрируйтесь или войдите в свой аккаунт\n"
-        f"4. Привяжите Discord аккаунт, используя ключ\n"
-        f"5. После подтверждения вы автоматически получите роль на сервере\n\n"
-        f"⚠️ **Важно:** Этот ключ уникален и может быть использован только один раз!",
-        ephemeral=True
-    )
+    await interaction.response.send_message(key_instructions(key), ephemeral=True)
 
     logger.info(f"Пользователь {interaction.user.name} (ID: {user_id}) получил ключ: {key}")
 
@@ -178,6 +453,10 @@ async def check_verification(interaction: discord.Interaction):
     c.execute("SELECT key, used FROM keys WHERE user_id = ?", (user_id,))
     result = c.fetchone()
 
+    # В hmac-режиме строка появляется только после использования ключа
+    if not result and KEY_MODE == 'hmac':
+        result = (derive_key(user_id, KEY_SECRETS[0]), 0)
+
     if not result:
         await interaction.response.send_message(
             "❌ У вас нет выданного ключа. Используйте команду `/key` для получения.",
@@ -207,6 +486,21 @@ async def stats(interaction: discord.Interaction):
     conn = sqlite3.connect(bot.db_path)
     c = conn.cursor()
 
+    if KEY_MODE == 'hmac':
+        c.execute("SELECT COUNT(*) FROM keys WHERE used = 1")
+        used_keys = c.fetchone()[0]
+        conn.close()
+
+        embed = discord.Embed(
+            title="📊 Статистика ключей",
+            description="Ключи вычисляются из Discord ID, пул не используется",
+            color=discord.Color.blue()
+        )
+        embed.add_field(name="Использовано", value=f"{used_keys:,}", inline=True)
+        embed.add_field(name="Секретов в ротации", value=f"{len(KEY_SECRETS)}", inline=True)
+        await interaction.response.send_message(embed=embed, ephemeral=True)
+        return
+
     c.execute("SELECT COUNT(*) FROM keys")
     total_keys = c.fetchone()[0]
 
@@ -245,60 +539,139 @@ def verify_webhook():
     if request.method == 'OPTIONS':
         response = jsonify({'status': 'ok'})
         response.headers.add('Access-Control-Allow-Origin', '*')
-        response.headers.add('Access-Control-Allow-Headers', 'Content-Type')
+        response.headers.add('Access-Control-Allow-Headers', 'Content-Type, Idempotency-Key')
         response.headers.add('Access-Control-Allow-Methods', 'POST, OPTIONS')
         return response
 
-    try:
-        data = request.json
+    idempotency_key = request.headers.get('Idempotency-Key')
+    data = request.get_json(silent=True) or {}
+    if not idempotency_key:
+        body, status_code = process_verification(data)
+        return jsonify(body), status_code
+
+    fingerprint = hashlib.sha256(request.get_data()).hexdigest()
+    body, status_code = handle_idempotent_verification(f"webhook_verify:{idempotency_key}", fingerprint, data)
+    return jsonify(body), status_code
+
+
+def handle_idempotent_verification(scope_key, fingerprint, data, notify_api=True):
+    """process_verification с сохранением ответа: повтор с тем же ключом получает прежний результат"""
+    cache_key = f"idempotency:{scope_key}"
+    record = idempotency_cache.begin(cache_key, fingerprint)
+    if record is not None:
+        if record['fingerprint'] != fingerprint:
+            return {'error': 'Idempotency-Key reused with a different request'}, 422
+        if record['state'] == 'pending':
+            return {'error': 'Request with this Idempotency-Key is in progress'}, 409
+        return record['body'], record['status']
+
+    body, status_code = process_verification(data, notify_api)
+    if status_code >= 500:
+        idempotency_cache.release(cache_key)
+    else:
+        idempotency_cache.complete(cache_key, fingerprint, body, status_code)
+    return body, status_code
 
+
+def run_verification_consumer():
+    """Обработка запросов верификации из шины событий (consumer group 'bot')"""
+    bus = create_bus(EVENT_BUS_URL)
+    consumer = f"bot-{socket.gethostname()}-{os.getpid()}"
+    logger.info(f"Чтение запросов верификации из шины как {consumer}")
+
+    while True:
+        try:
+            messages = bus.read_group(VERIFICATION_REQUESTS, 'bot', consumer, count=10, block_ms=5000)
+        except Exception as e:
+            logger.error(f"Ошибка чтения шины событий: {e}")
+            time.sleep(1)
+            continue
+
+        for message_id, fields in messages:
+            request_id = fields.pop('request_id', None)
+            idempotency_key = fields.pop('idempotency_key', None) or request_id
+            # Секрет в шину не пишется: доступ к потоку уже означает доверенного отправителя
+            fields.pop('secret', None)
+            fingerprint = hashlib.sha256(json.dumps(fields, sort_keys=True).encode()).hexdigest()
+            # API сам отмечает пользователя по результату, обратный webhook не нужен
+            body, status_code = handle_idempotent_verification(
+                f"bus_verify:{idempotency_key}", fingerprint, {**fields, 'secret': WEBHOOK_SECRET}, notify_api=False
+            )
+            try:
+                bus.publish(VERIFICATION_RESULTS, {'request_id': request_id, 'status': status_code, 'body': body})
+                bus.ack(VERIFICATION_REQUESTS, 'bot', message_id)
+            except Exception as e:
+                # Без ack сообщение переберёт другой потребитель; повтор безопасен благодаря идемпотентности
+                logger.error(f"Не удалось отправить результат верификации {request_id}: {e}")
+
+
+def process_verification(data, notify_api=True):
+    """Проверка ключа и выдача роли; возвращает (тело ответа, HTTP статус)"""
+    try:
         if data.get('secret') != WEBHOOK_SECRET:
-            return jsonify({'error': 'Unauthorized'}), 401
+            return {'error': 'Unauthorized'}, 401
 
         discord_id = data.get('discord_id')
         key = data.get('key')
         role_type = data.get('role_type', 'member')
 
         if not discord_id or not key:
-            return jsonify({'error': 'Missing required fields'}), 400
+            return {'error': 'Missing required fields'}, 400
 
         conn = sqlite3.connect(bot.db_path)
         c = conn.cursor()
 
-        c.execute("SELECT user_id, used FROM keys WHERE key = ?", (key,))
-        key_data = c.fetchone()
+        if KEY_MODE == 'hmac':
+            # Ключ проверяется пересчётом, в базе хранится только факт использования
+            if not is_derived_key_valid(discord_id, key):
+                conn.close()
+                return {'error': 'Invalid key'}, 404
 
-        if not key_data:
-            conn.close()
-            return jsonify({'error': 'Invalid key'}), 404
+            c.execute("SELECT 1 FROM keys WHERE user_id = ? AND used = 1", (int(discord_id),))
+            if c.fetchone():
+                conn.close()
+                return {'error': 'Key already used'}, 400
 
-        db_user_id, used = key_data
+            try:
+                c.execute(
+                    "INSERT INTO keys (key, user_id, used, used_at) VALUES (?, ?, 1, CURRENT_TIMESTAMP)",
+                    (key, int(discord_id))
+                )
+            except sqlite3.IntegrityError:
+                conn.close()
+                return {'error': 'Key already used'}, 400
+        else:
+            c.execute("SELECT user_id, used FROM keys WHERE key = ?", (key,))
+            key_data = c.fetchone()
 
-        # Проверяем, что ключ принадлежит этому пользователю
-        if db_user_id != int(discord_id):
-            conn.close()
-            return jsonify({'error': 'Key does not belong to this user'}), 403
+            if not key_data:
+                conn.close()
+                return {'error': 'Invalid key'}, 404
 
-        if used:
-            conn.close()
-            return jsonify({'error': 'Key already used'}), 400
+            db_user_id, used = key_data
 
-        # Отмечаем ключ как использованный
-        c.execute("UPDATE keys SET used = 1, used_at = CURRENT_TIMESTAMP WHERE key = ?", (key,))
+            # Проверяем, что ключ принадлежит этому пользователю
+            if db_user_id != int(discord_id):
+                conn.close()
+                return {'error': 'Key does not belong to this user'}, 403
+
+            if used:
+                conn.close()
+                return {'error': 'Key already used'}, 400
+
+            # Отмечаем ключ как использованный
+            c.execute("UPDATE keys SET used = 1, used_at = CURRENT_TIMESTAMP WHERE key = ?", (key,))
 
         # Определяем какую роль выдавать
         role_id = MEMBER_ROLE_ID if role_type == 'member' else VIEWER_ROLE_ID
         role_name = 'Участник' if role_type == 'member' else 'Зритель'
 
-        # Логируем верификацию
-        c.execute(
-            "INSERT INTO verification_logs (user_id, key, role_given) VALUES (?, ?, ?)",
-            (discord_id, key, role_name)
-        )
-
         conn.commit()
         conn.close()
 
+        # Логируем верификацию (запись уходит в БД пачкой из фонового потока)
+        log_writer.log(discord_id, key, role_name)
+
         # Выдаем роль пользователю (асинхронно)
         asyncio.run_coroutine_threadsafe(
             assign_role(int(discord_id), role_id, role_name),
@@ -306,16 +679,17 @@ def verify_webhook():
         )
 
         # Уведомляем основной API о верификации
-        asyncio.run_coroutine_threadsafe(
-            notify_main_api(discord_id),
-            bot.loop
-        )
+        if notify_api:
+            asyncio.run_coroutine_threadsafe(
+                notify_main_api(discord_id),
+                bot.loop
+            )
 
-        return jsonify({'success': True, 'message': f'Role {role_name} assigned'}), 200
+        return {'success': True, 'message': f'Role {role_name} assigned'}, 200
 
     except Exception as e:
         logger.error(f"Ошибка в webhook: {e}")
-        return jsonify({'error': 'Internal server error'}), 500
+        return {'error': 'Internal server error'}, 500
 
 
 async def assign_role(user_id, role_id, role_name):
@@ -326,7 +700,7 @@ async def assign_role(user_id, role_id, role_name):
             logger.error(f"Сервер с ID {GUILD_ID} не найден")
             return
 
-        member = guild.get_member(user_id)
+        member = await bot.get_or_fetch_member(guild, user_id)
         if not member:
             logger.error(f"Пользователь с ID {user_id} не найден на сервере")
             return
@@ -363,7 +737,8 @@ async def notify_main_api(discord_id):
                     "key": "",  # Ключ уже проверен
                     "role_type": "member",
                     "secret": WEBHOOK_SECRET
-                }
+                },
+                headers={"Idempotency-Key": f"discord-verified:{discord_id}"}
             )
             if response.status_code == 200:
                 logger.info(f"Основной API уведомлен о верификации пользователя {discord_id}")
@@ -377,6 +752,12 @@ def run_flask():
 
 
 if __name__ == '__main__':
+    log_writer.start()
+    atexit.register(log_writer.stop)
+
+    if VERIFICATION_TRANSPORT == 'bus':
+        threading.Thread(target=run_verification_consumer, name='verification-consumer', daemon=True).start()
+
     # Запускаем Flask в отдельном потоке
     flask_thread = threading.Thread(target=run_flask, daemon=True)
     flask_thread.start()